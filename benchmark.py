@@ -0,0 +1,51 @@
+from zircoin.blockchain import STARTING_TARGET
+from zircoin.benchmark import run_benchmark, live_target, is_target
+
+import argparse
+import json
+
+# args
+parser = argparse.ArgumentParser(
+    description='ZirCoin mining benchmark')
+parser.add_argument("--node", type=str, default="http://127.0.0.1:2227",
+                    help="Node the current mining target is read from (default: the local node)")
+parser.add_argument("--target", type=str,
+                    help="Mining target used for the expected time to find a block, instead of the node's target")
+parser.add_argument("--workers", type=int, help="Number of processes for the all core run, 0 for one per core")
+parser.add_argument("--duration", type=float, default=3, help="Seconds each measurement runs for")
+parser.add_argument("--transactions", type=int, nargs="+", default=[0, 100, 1000],
+                    help="Number of transactions in each block template")
+parser.add_argument("--json", default=False, action="store_true", help="Print the results as json")
+args = parser.parse_args()
+
+
+def progress(message):
+    if not args.json:
+        print(message)
+
+
+if args.target is not None:
+    if not is_target(args.target):
+        parser.error("--target has to be a hex string")
+    target = args.target.lower()
+else:
+    # the block store is not opened, opening it can repair or migrate files a running node is using
+    target = live_target(args.node.rstrip("/"))
+    if target is None:
+        progress(f"Could not get the current target from {args.node}, using the starting target")
+        target = STARTING_TARGET
+
+report = run_benchmark(target, args.transactions, workers=args.workers,
+                       duration=args.duration, progress=progress)
+
+if args.json:
+    print(json.dumps(report, indent=4))
+else:
+    print(f"\nTarget: {report['target']}")
+    for result in report["results"]:
+        print(f"\n{result['transactions']} transactions ({result['template_bytes']} bytes)")
+        for mode in ("single_core", "all_cores"):
+            hashrate = result["hashrate"][mode]
+            block_time = result["expected_block_time"][mode]
+            block_time = f"{round(block_time)}s" if block_time is not None else "never"
+            print(f"  {mode.replace('_', ' ')}: {round(hashrate)} H/s, expected time to block: {block_time}")
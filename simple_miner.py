@@ -1,5 +1,4 @@
-from zircoin.api import Client
-from zircoin.wallet import Wallet
+from zircoin.workserver import run_pool_workers
 
 import argparse
 
@@ -7,12 +6,21 @@ import argparse
 parser = argparse.ArgumentParser(
     description='ZirCoin command line miner')
 parser.add_argument("--wallet", "-w", type=str, help="Path to wallet file")
+parser.add_argument("--workers", type=int, help="Number of mining processes, 0 for one per core")
+parser.add_argument("--pool", type=str,
+                    help="Mine for a node's work server (such as http://192.168.1.2:2228) instead of running a client")
 args = parser.parse_args()
 
-# modules
+if __name__ == "__main__":
+    if args.pool:
+        # pool workers only hash, the node they mine for keeps the blockchain
+        run_pool_workers(args.pool.rstrip("/"), args.workers)
+    else:
+        from zircoin.api import Client
+        from zircoin.wallet import Wallet
 
-wallet = Wallet(file=(args.wallet if args.wallet else "wallet.json"))
-client = Client()
+        wallet = Wallet(file=(args.wallet if args.wallet else "wallet.json"))
+        client = Client(mining_workers=args.workers)
 
-client.miner.mine(wallet)
+        client.miner.mine(wallet, workers=args.workers)
 
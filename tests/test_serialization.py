@@ -0,0 +1,44 @@
+import unittest
+
+from zircoin.canonical import block_bytes
+from zircoin.serialization import decode_binary, encode_binary
+from zircoin.structures import Block
+
+
+class MappedRecordRoundTrip(unittest.TestCase):
+    def block(self):
+        return {
+            "height": 1,
+            "time": 1600000000.5,
+            "blockchain_id": "ab" * 16,
+            "protocol_version": "0.2.0",
+            "transactions": [{
+                "type": "coinbase",
+                "sender": "coinbase",
+                "receiver": "cd" * 32,
+                "amount": 50,
+                "timestamp": 1600000000.25,
+                "id": "ef" * 32,
+                "memo": {"notes": ["abcd"]}
+            }],
+            "previous_hash": "00" * 32,
+            "target": "0f" * 32,
+            "nonce": "1234",
+            "hash": "12" * 32,
+            "memo": ["abcd", {"ref": "beef"}]
+        }
+
+    def test_nested_hex_strings_stay_strings(self):
+        block = self.block()
+        decoded = Block.from_dict(decode_binary(encode_binary(Block.from_dict(block)), raw_hex=True))
+
+        self.assertEqual(decoded.to_dict(), block)
+        self.assertEqual(block_bytes(decoded), block_bytes(block))
+
+    def test_plain_decode(self):
+        block = self.block()
+        self.assertEqual(decode_binary(encode_binary(block)), block)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 from zircoin.wallet import Wallet
 from zircoin.miner import Miner
+from zircoin.mining import MiningPool
 from zircoin.logger import Logger
 from zircoin.server import Server
 from zircoin.consensus import Consensus
@@ -8,6 +9,8 @@ from zircoin.connections import ConnectionPool
 from zircoin.blockchain import Blockchain
 from zircoin.version import PROTOCOL_VERSION, NETWORKING_VERSION
 from zircoin.utils import test_hashrate
+from zircoin.telemetry import MiningStats
+from zircoin.verification import shared_verifier
 
 import json
 from hashlib import sha256
@@ -19,7 +22,8 @@ from threading import Thread
 
 
 class Client():
-    def __init__(self, CONFIG=json.load(open("config.json", "r")), blockchain_file="blockchain.json"):
+    def __init__(self, CONFIG=json.load(open("config.json", "r")), blockchain_file="blockchain.json",
+                 mining_workers=None):
 
         self.NODE_ID = sha256(str(getrandbits(256)).encode()).hexdigest()
         self.CONFIG = CONFIG
@@ -28,8 +32,20 @@ class Client():
             "port": 2227
         }
 
-        self.blockchain = Blockchain(self.CONFIG["blockchain_id"], file=blockchain_file)
-        self.blockchain.load()
+        # the verification workers are forked before any other thread starts, and only if they are used
+        verification_config = self.CONFIG.get("verification", {})
+        verify_on_load = verification_config.get("verify_on_load", False)
+        self.chain_verifier = shared_verifier(verification_config.get("workers") if verify_on_load else 1)
+
+        # so are the mining workers, the miner only runs once the other threads are up
+        if mining_workers is None:
+            mining_workers = self.CONFIG.get("mining", {}).get("workers", 1)
+        self.mining_pool = MiningPool(mining_workers)
+
+        self.blockchain = Blockchain(self.CONFIG["blockchain_id"], file=blockchain_file,
+                                     storage_config=self.CONFIG.get("storage"),
+                                     mempool_config=self.CONFIG.get("mempool"))
+        self.blockchain.load(verify=verify_on_load, verifier=self.chain_verifier)
 
         self.connection_pool = ConnectionPool(
             CONFIG,
@@ -37,24 +53,30 @@ class Client():
             2227
         )
 
+        self.mining_stats = MiningStats()
+
         self.http_routes = HttpRoutes(
             self.blockchain,
             self.connection_pool,
             self.SERVER_CONFIG,
             self.CONFIG,
-            self.NODE_ID
+            self.NODE_ID,
+            mining_stats=self.mining_stats
         )
 
         self.consensus = Consensus(
             self.blockchain,
-            self.connection_pool
+            self.connection_pool,
+            verifier=self.chain_verifier
         )
 
         self.miner = Miner(
             self.blockchain,
             self.CONFIG,
             self.consensus,
-            self.connection_pool
+            self.connection_pool,
+            stats=self.mining_stats,
+            pool=self.mining_pool
         )
 
         self.start_threads()
@@ -74,7 +96,8 @@ class Client():
         sleep(0.1)
 
 class Node():
-    def __init__(self, CONFIG=json.load(open("config.json", "r")), blockchain_file="blockchain.json"):
+    def __init__(self, CONFIG=json.load(open("config.json", "r")), blockchain_file="blockchain.json",
+                 mining_workers=None):
 
         self.NODE_ID = sha256(str(getrandbits(256)).encode()).hexdigest()
         self.CONFIG = CONFIG
@@ -83,8 +106,20 @@ class Node():
             "port": 2227
         }
 
-        self.blockchain = Blockchain(self.CONFIG["blockchain_id"], file=blockchain_file)
-        self.blockchain.load()
+        # the verification workers are forked before any other thread starts, and only if they are used
+        verification_config = self.CONFIG.get("verification", {})
+        verify_on_load = verification_config.get("verify_on_load", False)
+        self.chain_verifier = shared_verifier(verification_config.get("workers") if verify_on_load else 1)
+
+        # so are the mining workers, the miner only runs once the other threads are up
+        if mining_workers is None:
+            mining_workers = self.CONFIG.get("mining", {}).get("workers", 1)
+        self.mining_pool = MiningPool(mining_workers)
+
+        self.blockchain = Blockchain(self.CONFIG["blockchain_id"], file=blockchain_file,
+                                     storage_config=self.CONFIG.get("storage"),
+                                     mempool_config=self.CONFIG.get("mempool"))
+        self.blockchain.load(verify=verify_on_load, verifier=self.chain_verifier)
 
         self.connection_pool = ConnectionPool(
             CONFIG,
@@ -92,12 +127,15 @@ class Node():
             2227
         )
 
+        self.mining_stats = MiningStats()
+
         self.http_routes = HttpRoutes(
             self.blockchain,
             self.connection_pool,
             self.SERVER_CONFIG,
             self.CONFIG,
-            self.NODE_ID
+            self.NODE_ID,
+            mining_stats=self.mining_stats
         )
 
         self.server = Server(
@@ -108,14 +146,17 @@ class Node():
 
         self.consensus = Consensus(
             self.blockchain,
-            self.connection_pool
+            self.connection_pool,
+            verifier=self.chain_verifier
         )
 
         self.miner = Miner(
             self.blockchain,
             self.CONFIG,
             self.consensus,
-            self.connection_pool
+            self.connection_pool,
+            stats=self.mining_stats,
+            pool=self.mining_pool
         )
 
         self.start()
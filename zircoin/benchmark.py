@@ -0,0 +1,199 @@
+import os
+import platform
+from time import time
+from threading import Event
+from random import getrandbits
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+from nacl.encoding import HexEncoder
+from nacl.signing import SigningKey
+
+from .canonical import block_bytes
+from .mining import search_nonces
+from .transactions import TransactionPool
+from .verification import pool_context
+from .version import PROTOCOL_VERSION
+
+# no hash is below this target, so the search never stops early
+IMPOSSIBLE_TARGET = "0" * 64
+
+
+def make_template(transaction_count, target=IMPOSSIBLE_TARGET):
+    """
+    Builds a block template like the ones the miner hashes, with signed payments
+
+    :param int transaction_count: Number of payments besides the coinbase transaction
+    :param str target: Target written into the template
+    :return dict template: The template, without nonce and hash
+    """
+    signing_key = SigningKey.generate()
+    private_key = signing_key.encode(encoder=HexEncoder).decode()
+    public_key = signing_key.verify_key.encode(encoder=HexEncoder).decode()
+    receiver = format(getrandbits(256), "x").zfill(64)
+
+    pool = TransactionPool(None)
+    transactions = [pool.create_coinbase_transaction(public_key, 5)]
+    for _ in range(transaction_count):
+        transactions.append(pool.create_transaction(private_key, public_key, receiver, 1))
+
+    return {
+        "height": 1,
+        "time": time(),
+        "protocol_version": PROTOCOL_VERSION,
+        "blockchain_id": "benchmark",
+        "transactions": transactions,
+        "previous_hash": format(getrandbits(256), "x").zfill(64),
+        "target": target
+    }
+
+
+def is_target(value):
+    if not isinstance(value, str) or not value:
+        return False
+
+    try:
+        int(value, 16)
+    except ValueError:
+        return False
+
+    return True
+
+
+def live_target(node):
+    """
+    Asks a running node for the target the next block has to be mined at.
+    The block store is never opened, opening it can repair or migrate files
+    the node is using.
+
+    :param str node: Url of the node, such as http://127.0.0.1:2227
+    :return str target: The node's current target, None if the node can't be reached
+    """
+    try:
+        info = requests.get(node + "/info", timeout=2).json()
+        if isinstance(info, dict) and is_target(info.get("target")):
+            return info["target"].lower()
+
+        # nodes from before /info reported the target
+        block = requests.get(node + "/latest-block", timeout=2).json()
+        if isinstance(block, dict) and is_target(block.get("target")):
+            return block["target"].lower()
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+
+    return None
+
+
+def hash_for(template, duration, range_size=5000):
+    """
+    Hashes the template with the miner's nonce search for a while
+
+    :param dict template: The template to hash
+    :param float duration: Seconds to hash for
+    :param int range_size: Number of nonces tried between checks of the time
+    :return int attempts: Number of hashes done
+    """
+    attempts = 0
+    nonce = getrandbits(64)
+    stop = time() + duration
+    # never set, so the cancel event of a mining pool worker doesn't cut the measurement short
+    cancel = Event()
+    while time() < stop:
+        _, tried = search_nonces(template, IMPOSSIBLE_TARGET, nonce, range_size, cancel=cancel)
+        attempts += tried
+        nonce += range_size
+
+    return attempts
+
+
+def measure_hashrate(template, workers=1, duration=3, executor=None):
+    """
+    Measures how many hashes per second the miner does on a template
+
+    :param dict template: The template to hash
+    :param int workers: Number of processes hashing at once
+    :param float duration: Seconds to hash for
+    :param executor: Process pool to hash in (such as MiningPool.executor), a new one is started if None.
+                     Starting one forks, so a process that already runs other threads should pass its own.
+    :return float hashrate: Hashes per second, summed over all workers
+    """
+    if workers <= 1 or (executor is None and not pool_context()):
+        start = time()
+        attempts = hash_for(template, duration)
+        return attempts / (time() - start)
+
+    if executor is not None:
+        return hash_in(executor, template, workers, duration)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as executor:
+        return hash_in(executor, template, workers, duration)
+
+
+def hash_in(executor, template, workers, duration):
+    # a short warm up so starting the processes isn't measured
+    list(executor.map(hash_for, [template] * workers, [0.1] * workers))
+
+    start = time()
+    attempts = sum(executor.map(hash_for, [template] * workers, [duration] * workers))
+    return attempts / (time() - start)
+
+
+def expected_block_time(hashrate, target):
+    """
+    Gets the average time it takes to find a block
+
+    :param float hashrate: Hashes per second
+    :param str target: The mining target
+    :return float seconds: Expected seconds per block, None if the hashrate or target is 0
+    """
+    # a hash is valid with a chance of target / 2^256
+    chance = int(target, 16) / 2 ** (4 * len(target))
+    if not hashrate or not chance:
+        return None
+
+    return 1 / (chance * hashrate)
+
+
+def run_benchmark(target, transaction_counts=(0, 100, 1000), workers=None, duration=3, progress=None):
+    """
+    Measures single core and all core mining throughput on templates of different sizes
+
+    :param str target: Target used for the expected time to find a block
+    :param tuple transaction_counts: Number of payments in each template
+    :param int workers: Processes used for the all core run, None or 0 for one per core
+    :param float duration: Seconds each measurement runs for
+    :param progress: Called with a message before each measurement
+    :return dict report: The results, ready to be dumped as json
+    """
+    workers = workers or os.cpu_count() or 1
+
+    results = []
+    for count in transaction_counts:
+        template = make_template(count, target)
+        result = {
+            "transactions": count,
+            "template_bytes": len(block_bytes(template)),
+            "hashrate": {},
+            "expected_block_time": {}
+        }
+
+        for mode, mode_workers in (("single_core", 1), ("all_cores", workers)):
+            if progress:
+                progress(f"Hashing a {count} transaction template with {mode_workers} worker(s)...")
+
+            hashrate = measure_hashrate(template, mode_workers, duration)
+            result["hashrate"][mode] = round(hashrate, 1)
+            seconds = expected_block_time(hashrate, target)
+            result["expected_block_time"][mode] = round(seconds, 2) if seconds is not None else None
+
+        results.append(result)
+
+    return {
+        "protocol_version": PROTOCOL_VERSION,
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "workers": workers,
+        "duration": duration,
+        "target": target,
+        "results": results
+    }
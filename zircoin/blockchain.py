@@ -1,12 +1,21 @@
 import math
-import json
 import pickle
+from bisect import bisect_left
+from collections import deque
 from hashlib import sha256
 from time import time
 from random import getrandbits
 
-from os.path import exists
 from .logger import Logger
+from .canonical import block_bytes
+from .events import Notifier
+from .ledger import Ledger
+from .mining import MiningEngine
+from .chainstate import ChainState
+from .indexes import AddressIndex, TimeIndex
+from .storage import open_storage, read_snapshot, write_snapshot
+from .structures import Block, block_header
+from .verification import ChainVerifier, SignatureVerifier
 from .transactions import TransactionPool
 
 from .version import (
@@ -17,21 +26,92 @@ from .version import (
 miner = Logger("miner")
 bc = Logger("blockchain")
 
+# pruned nodes keep at least this many full blocks, which covers the 40 block
+# target window, the blocks the transaction pool looks back at and a rewind during sync
+MIN_PRUNE_DEPTH = 100
+
+# target of a new blockchain, before the first retarget
+STARTING_TARGET = "00000fffffffffffffffffffffffffffffffffffffffffffffffffffffffffff"
+
+# the target is recalculated every this many blocks
+RETARGET_INTERVAL = 40
+
+
+def pruned_length(blocks):
+    # pruned blocks are always at the start of the chain
+    return bisect_left(blocks, True, key=lambda block: not block.get("pruned"))
+
+
+class ChainWindow:
+    """
+    Stands in for the chain while blocks are replayed to verify them. Only
+    the blocks the rules look back at are kept (the first two and the
+    latest ones, for calculate_target), so replaying a chain doesn't read
+    all of it into memory.
+    """
+
+    def __init__(self, size=RETARGET_INTERVAL):
+        self.head = []
+        self.tail = deque(maxlen=size)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("block index out of range")
+
+        if index < len(self.head):
+            return self.head[index]
+        if index >= self.length - len(self.tail):
+            return self.tail[index - (self.length - len(self.tail))]
+
+        raise IndexError("block is no longer kept in the replay window")
+
+    def append(self, block):
+        if len(self.head) < 2:
+            self.head.append(block)
+        self.tail.append(block)
+        self.length += 1
+
 
 class Blockchain():
-    def __init__(self, blockchain_id, create_genesis_block=True, autosave=True, file="blockchain.json"):
+    def __init__(self, blockchain_id, create_genesis_block=True, autosave=True, file="blockchain.json",
+                 storage_config=None, storage=None, mempool_config=None, signature_verifier=None):
         self.chain = []
-        self.transaction_pool = TransactionPool(self)
-        self.target = "00000fffffffffffffffffffffffffffffffffffffffffffffffffffffffffff"
+        self.state = ChainState(STARTING_TARGET)
+        self.reset_indexes()
+
+        # published with (height, tip hash) whenever the tip of the chain changes
+        self.tip_events = Notifier((self.height, self.previous_hash))
+        self.mempool_config = mempool_config
+
+        # kept across clear() and shared with replays, so its threads and verified signatures aren't lost
+        self.signature_verifier = signature_verifier or SignatureVerifier()
+        self.transaction_pool = TransactionPool(self, verifier=self.signature_verifier, **(mempool_config or {}))
         self.autosave = autosave
         self.blockchain_file = file
+        self.storage_config = storage_config
+        self.storage = storage if storage is not None else open_storage(file, storage_config)
+        self.snapshot_interval = (storage_config or {}).get("snapshot_interval", 1000)
+        self.snapshot_height = None
+
+        # number of blocks at the start of the chain that only have their header left
+        self.prune_height = 0
+        self.prune_depth = (storage_config or {}).get("prune", 0)
+        if self.prune_depth and self.prune_depth < MIN_PRUNE_DEPTH:
+            bc.info(f"Keeping the last {MIN_PRUNE_DEPTH} blocks, the minimum for a pruned node")
+            self.prune_depth = MIN_PRUNE_DEPTH
 
         self.BLOCKCHAIN_ID = blockchain_id
         self.PROTOCOL_VERSION = PROTOCOL_VERSION
         self.SUPPORTED_PROTOCOL_VERSIONS = SUPPORTED_PROTOCOL_VERSIONS
 
         if create_genesis_block:
-            self.chain.append(self.make_genesis_block())
+            self.append_block(self.make_genesis_block())
 
     def __str__(self):
         text = ""
@@ -51,37 +131,212 @@ class Blockchain():
 
     @property
     def block_reward(self):
-        reward = 5
-        for i in range(1, self.height):
-            if i % 100000 == 0:
-                reward *= 0.5
+        return self.state.block_reward
 
-        return reward
+    @property
+    def target(self):
+        return self.state.target
+
+    @target.setter
+    def target(self, target):
+        self.state.target = target
 
     def save(self):
-        with open(self.blockchain_file, "w") as f:
-            json.dump(self.chain, f)
-
-    def load(self):
-        if exists(self.blockchain_file):
-            with open(self.blockchain_file, "r") as f:
-                try:
-                    blockchain = json.load(f)
-                except json.decoder.JSONDecodeError:
+        if self.storage is None:
+            return
+
+        self.storage.sync(self.chain)
+
+        # lazy stores serve the chain from disk, so the blocks don't have to stay in memory
+        if self.storage.lazy:
+            self.chain = self.storage.load()
+
+        if self.snapshot_interval and self.height is not None and \
+                self.height - (self.snapshot_height or 0) >= self.snapshot_interval:
+            # the snapshot can't cover blocks that might still be lost in a crash
+            self.storage.flush(fsync=True)
+            self.save_snapshot()
+
+        if self.prune_depth:
+            self.prune()
+
+    def prune(self):
+        """
+        Cuts the blocks deeper than prune_depth down to their headers. Only
+        blocks covered by the last snapshot are pruned, because the ledger
+        can't be rebuilt from headers.
+        """
+        if self.snapshot_height is None:
+            return
+
+        stop = min(len(self.chain) - self.prune_depth, self.snapshot_height + 1)
+        if stop <= self.prune_height:
+            return
+
+        pruned = self.storage.prune(self.prune_height, stop)
+        if pruned is None:
+            bc.info("The block store does not support pruning, keeping every block")
+            self.prune_depth = 0
+            return
+
+        # only what the store actually pruned is stripped and advertised, so it matches the disk after a restart
+        stop = pruned
+        if stop <= self.prune_height:
+            return
+
+        # lazy chains are read back from the pruned store
+        if not self.storage.lazy:
+            for height in range(self.prune_height, stop):
+                self.chain[height] = Block.from_dict(block_header(self.chain[height]))
+
+        self.prune_height = stop
+
+    @property
+    def snapshot_file(self):
+        return self.storage.path + ".snapshot"
+
+    def save_snapshot(self):
+        """
+        Writes the state derived from the chain next to the block store, so the
+        next start only has to replay the blocks added after it
+        """
+        write_snapshot(self.snapshot_file, {
+            "version": 4,
+            "length": len(self.chain),
+            "hash": self.previous_hash,
+            "balances": self.ledger.balances,
+            "state": self.state.to_dict(),
+            "addresses": self.address_index.positions,
+            "times": self.time_index.times.tolist(),
+            "txids": list(self.txids)
+        })
+        self.snapshot_height = self.height
+
+    def restore_snapshot(self):
+        snapshot = read_snapshot(self.snapshot_file)
+        if not snapshot or snapshot.get("version") != 4:
+            return False
+
+        length = snapshot["length"]
+        if not 0 < length <= len(self.chain) or self.chain[length - 1]["hash"] != snapshot["hash"]:
+            bc.info("Snapshot does not match the stored blockchain, rebuilding from blocks")
+            return False
+
+        self.block_hashes = self.storage.block_hashes(length)
+        self.hash_index = {block_hash: position for position, block_hash in enumerate(self.block_hashes)}
+        self.ledger = Ledger()
+        self.ledger.balances = snapshot["balances"]
+        self.state = ChainState.from_dict(snapshot["state"], self.target)
+        self.address_index = AddressIndex(snapshot["addresses"])
+        self.time_index = TimeIndex(snapshot["times"])
+        self.txids = set(snapshot["txids"])
+        self.snapshot_height = self.height
+
+        # replay the blocks added since the snapshot was taken
+        for block in self.chain[length:]:
+            self.index_block(block)
+
+        return True
+
+    def load(self, verify=False, workers=None, verifier=None):
+        """
+        Loads the blockchain from the block store
+
+        :param bool verify: Fully validate the stored blocks instead of trusting them
+        :param int workers: Number of processes used for verification, None for a few
+        :param ChainVerifier verifier: Verifier to check the blocks with, a new one is started if None
+        """
+        if self.storage is None:
+            return False
+
+        blockchain = self.storage.load()
+        if not blockchain:
+            return True
+
+        if len(blockchain) > len(self.chain):
+            prune_height = pruned_length(blockchain)
+            if prune_height and verify:
+                bc.info("Stored blockchain is pruned, restoring it from its snapshot without verifying")
+                verify = False
+
+            if verify:
+                verified = self.verify_chain(blockchain, workers, verifier)
+                if not verified:
                     return False
 
-                if len(blockchain) > len(self.chain):
-                    self.chain = blockchain
-                    bc.info(f"Loaded blockchain from {self.blockchain_file}")
-                    self.target = self.last_block["target"]
-                    self.calculate_target()
-                else:
+            previous_chain = self.chain
+            self.chain = blockchain
+            self.prune_height = prune_height
+            if verify:
+                self.adopt_indexes(verified)
+            elif not self.restore_snapshot():
+                if prune_height:
+                    bc.error("Stored blockchain is pruned and its snapshot is missing, it has to be synced again")
+                    self.chain = previous_chain
+                    self.prune_height = 0
                     return False
 
-            return True
+                self.rebuild_indexes()
+            bc.info(f"Loaded blockchain from {self.storage.path}")
+            self.target = self.last_block["target"]
+            self.calculate_target()
+            self.tip_events.publish((self.height, self.previous_hash))
         else:
-            open(self.blockchain_file, "a").close()
-            return True
+            return False
+
+        return True
+
+    def verify_chain(self, blocks, workers=None, verifier=None):
+        """
+        Validates a whole chain. The stateless checks run in parallel first, then
+        the blocks are replayed in order for the checks that need the chain.
+
+        :param list blocks: The blocks to verify, starting at the genesis block
+        :param int workers: Number of worker processes, None for a few
+        :param ChainVerifier verifier: An existing verifier to reuse
+        :return Blockchain replay: In-memory blockchain holding the verified state, or None if the chain is invalid
+        """
+        own_verifier = verifier is None
+        verifier = verifier or ChainVerifier(workers)
+        total = len(blocks)
+        reported = [0]
+
+        def progress(checked, total):
+            if checked - reported[0] >= total / 10 or checked == total:
+                reported[0] = checked
+                bc.info(f"Verified signatures and hashes of {checked}/{total} blocks")
+
+        try:
+            failure = verifier.verify(blocks, progress=progress)
+        finally:
+            if own_verifier:
+                verifier.close()
+
+        if failure:
+            bc.error(f"Block #{failure[0]} is invalid: {failure[1]}")
+            return None
+
+        # only the indexes are kept, the blocks themselves stay in the store
+        replay = Blockchain(self.BLOCKCHAIN_ID, create_genesis_block=False, autosave=False, file=None,
+                            signature_verifier=self.signature_verifier)
+        replay.chain = ChainWindow()
+        for block in blocks:
+            if not replay.add(block, verbose=True, prechecked=True):
+                return None
+
+            if block["height"] and block["height"] % 10000 == 0:
+                bc.info(f"Validated {block['height']}/{total - 1} blocks")
+
+        return replay
+
+    def adopt_indexes(self, replay):
+        self.hash_index = replay.hash_index
+        self.block_hashes = replay.block_hashes
+        self.ledger = replay.ledger
+        self.state = replay.state
+        self.address_index = replay.address_index
+        self.time_index = replay.time_index
+        self.txids = replay.txids
 
     def make_genesis_block(self):
         block = {
@@ -121,24 +376,58 @@ class Blockchain():
 
     @staticmethod
     def hash(block):
-        block_str = json.dumps(block, sort_keys=True).encode()
-        block["hash"] = sha256(block_str).hexdigest()
+        block["hash"] = sha256(block_bytes(block)).hexdigest()
 
         return block
 
     def contains_hash(self, block_hash):
+        return block_hash in self.hash_index
+
+    def index_block(self, block):
+        height = len(self.block_hashes)
+
+        # the state reads the target, so it goes first and a bad block raises before anything changed
+        self.state.apply_block(block)
+
+        # maps the block hash to its position in the chain
+        self.hash_index[block["hash"]] = height
+        self.block_hashes.append(block["hash"])
+
+        self.ledger.apply_block(block)
+        self.address_index.apply_block(height, block)
+        self.time_index.apply_block(block)
+
+        for transaction in block["transactions"]:
+            self.txids.add(transaction["id"])
+
+    def reset_indexes(self):
+        self.hash_index = {}
+        self.block_hashes = []
+        self.ledger = Ledger()
+        self.state = ChainState(self.target)
+        self.address_index = AddressIndex()
+        self.time_index = TimeIndex()
+        self.txids = set()
+
+    def rebuild_indexes(self):
+        self.reset_indexes()
+
         for block in self.chain:
-            if block["hash"] == block_hash:
-                return True
+            self.index_block(block)
 
-        return False
+    def append_block(self, block):
+        block = Block.from_dict(block)
+        # indexed first, so a block that can't be indexed never ends up in the chain without its state
+        self.index_block(block)
+        self.chain.append(block)
+        self.tip_events.publish((self.height, self.previous_hash))
+
+        # the encoding is only needed while the block is validated, don't keep it for the whole chain
+        block.drop_encoding()
 
     @property
     def previous_hash(self):
-        if self.last_block:
-            return self.last_block["hash"]
-        else:
-            return None
+        return self.state.tip_hash
 
     @property
     def last_block(self):
@@ -149,32 +438,22 @@ class Blockchain():
 
     @property
     def height(self):
-        last_block = self.last_block
-        if last_block:
-            return last_block["height"]
-        else:
-            return None
+        return self.state.height
 
     @property
     def block_inv(self):
-        inventory = []
-        for block in self.chain:
-            inventory.append(block["hash"])
-
-        return inventory
+        return self.block_hashes
 
     @property
     def transaction_inv(self):
-        inventory = []
-        for block in self.chain:
-            for transaction in block["transactions"]:
-                inventory.append(transaction)
+        return self.txids
 
-        return inventory
+    def add(self, block, verbose=False, prechecked=False):
+        # validating and storing the record shares its cached encoding
+        block = Block.from_dict(block)
 
-    def add(self, block, verbose=False):
-        if self.validate(block, verbose=verbose):
-            self.chain.append(block)
+        if self.validate(block, verbose=verbose, prechecked=prechecked):
+            self.append_block(block)
             self.transaction_pool.update_pool(self.chain)
             if self.autosave:
                 self.save()
@@ -185,7 +464,15 @@ class Blockchain():
     def valid_pow(self, block):
         return block["hash"] < self.target
 
-    def validate(self, block, verbose=False):
+    def validate(self, block, verbose=False, prechecked=False):
+        """
+        Checks a block against the rules and the current chain tip
+
+        :param dict block: The block to validate
+        :param bool verbose: Log why the block is invalid
+        :param bool prechecked: Skip the hash and signature checks, because verification.check_block already ran them
+        :return bool result: True if the block can be added
+        """
 
         if block["protocol_version"] not in self.SUPPORTED_PROTOCOL_VERSIONS:
             bc.error(f"Failed to validate block {block['height']}, please update zircoin to the latest version. https://zircoin.network")
@@ -201,7 +488,7 @@ class Blockchain():
             return False
 
         # if the block is already in the blockchain, the block is invalid
-        if block["hash"] in self.block_inv:
+        if block["hash"] in self.hash_index:
             if verbose:
                 bc.error(
                     "Block #" + str(block["height"]) + " is invalid: Block already in blockchain")
@@ -244,7 +531,7 @@ class Blockchain():
             return False
 
         # validate trasactions
-        if not self.validate_block_transactions(block):
+        if not self.validate_block_transactions(block, check_signatures=not prechecked):
             if verbose:
                 bc.error(
                     "Block #" + str(block["height"]) + " is invalid: Invalid transactions detected")
@@ -263,17 +550,21 @@ class Blockchain():
                         "Block #" + str(block["height"]) + " is invalid: Timestamp is in the future")
                 return False
 
-        # validate proof of work
-        new_block = block.copy()
-        del new_block["hash"]
-        new_block = json.dumps(new_block, sort_keys=True).encode()
-
-        if not sha256(new_block).hexdigest() == block["hash"]:
+        # the target is a 64 character hex string and has to be the one the chain expects
+        if block["target"] != self.target:
             if verbose:
                 bc.error(
-                    "Block #" + str(block["height"]) + " is invalid: Hash is invalid")
+                    "Block #" + str(block["height"]) + " is invalid: Target is incorrect")
             return False
 
+        # validate proof of work
+        if not prechecked:
+            if not sha256(block_bytes(block)).hexdigest() == block["hash"]:
+                if verbose:
+                    bc.error(
+                        "Block #" + str(block["height"]) + " is invalid: Hash is invalid")
+                return False
+
         if self.valid_pow(block):
             return True
         else:
@@ -310,7 +601,7 @@ class Blockchain():
 
         return True
 
-    def validate_block_transactions(self, block):
+    def validate_block_transactions(self, block, check_signatures=True):
         # if there are no transactions, the tx is invalid
         if len(block["transactions"]) < 1:
             return False
@@ -328,13 +619,22 @@ class Blockchain():
         if block["transactions"][0]["amount"] != self.block_reward:
             return False
 
+        # a transaction can only be confirmed once, this stops signed transactions being replayed
+        block_txids = set()
+        for transaction in block["transactions"][1:]:
+            if transaction["id"] in self.txids or transaction["id"] in block_txids:
+                return False
+            block_txids.add(transaction["id"])
+
         if not self.check_for_overspent_transactions(block):
             return False
 
-        for i in range(1, len(block["transactions"])):
-            transaction = block["transactions"][i]
+        payments = block["transactions"][1:]
+        if check_signatures and not all(self.signature_verifier.verify(payments, block["protocol_version"])):
+            return False
 
-            if not self.transaction_pool.validate_transaction(transaction):
+        for transaction in payments:
+            if not self.transaction_pool.validate_transaction(transaction, check_signature=False):
                 return False
 
         return True
@@ -347,7 +647,7 @@ class Blockchain():
         if self.target != self.last_block["target"]:
             return False
 
-        interval = 40
+        interval = RETARGET_INTERVAL
 
         if (self.height + 1) % interval == 0:
 
@@ -377,53 +677,82 @@ class Blockchain():
         return False
 
     def get_blocks_after_timestamp(self, timestamp):
-        blocks = []
-        for block in self.chain:
-            if block["time"] > timestamp:
-                blocks.append(block)
+        return self.get_blocks_between(since=timestamp)
+
+    def get_blocks_between(self, since=None, until=None):
+        """
+        Gets the blocks mined in a time range, using the time index
 
-        return blocks
+        :param float since: Only include blocks mined after this time
+        :param float until: Only include blocks mined at or before this time
+        :return list blocks: The blocks, oldest first
+        """
+        start, stop = self.time_index.range(since, until)
+        return self.chain[start:stop]
 
     def get_balance(self, public_key):
-        balance = 0.0
+        return self.ledger.get_balance(public_key)
 
-        for block in self.chain:
-            for transaction in block["transactions"]:
-                if transaction["receiver"] == public_key:
-                    balance += transaction["amount"]
-                if transaction["sender"] == public_key:
-                    balance -= transaction["amount"]
+    def get_transaction_history(self, public_key, offset=0, limit=None):
+        """
+        Gets the transactions a wallet sent or received, oldest first
 
-        return balance
+        :param str public_key: The wallet to look up
+        :param int offset: Number of transactions to skip, not counting those in pruned blocks
+        :param int limit: Maximum number of transactions to return, None for all
+        :return list transactions: The transactions
+        """
+        if hasattr(self.chain, "address_transactions"):
+            return self.chain.address_transactions(public_key, offset, limit)
+
+        # the transactions of pruned blocks are gone, they are skipped before paging
+        positions = self.address_index.get(public_key, offset, limit, start_height=self.prune_height)
+        return [self.chain[height]["transactions"][position] for height, position in positions]
 
     def get_block_from_hash(self, block_hash):
-        for block in self.chain:
-            if block["hash"] == block_hash:
-                return block
+        position = self.hash_index.get(block_hash)
+        if position is None:
+            return None
+
+        return self.chain[position]
 
-        return None
+    def mine_new_block(self, wallet, engine=None):
+        """
+        Mines the next block
 
-    def mine_new_block(self, wallet):
+        :param Wallet wallet: Wallet the block reward is paid to
+        :param MiningEngine engine: Engine that searches for the nonce, None mines in this process
+        :return dict block: The mined block, or None if another block was added first
+        """
 
         if self.calculate_target(print_block_times=True):
             miner.info("New mining target: " + str(self.target))
 
+        engine = engine or MiningEngine()
+
         # generate new blocks until a valid one is found
         start = time()
 
         block_to_mine = self.height + 1
 
-        block = self.make_block(wallet)
-        while not self.valid_pow(block):
+        block = None
+        while block is None:
             if self.height >= block_to_mine:
                 miner.info(f"✗ Failed to mine block #{block_to_mine}")
                 return None
 
-            block = self.make_block(wallet)
+            if engine.stopped:
+                return None
+
+            # a new template is made whenever the engine gives up on the current one
+            block = engine.mine(self, wallet)
 
         end = time()
         time_taken = end - start
 
+        # validating it here and adding it later both use the record's cached encoding
+        block = Block.from_dict(block)
+
         # if the block is invalid, don't add it
         if not self.validate(block, verbose=True):
             miner.error("Invalid block")
@@ -434,5 +763,13 @@ class Blockchain():
         return block
 
     def clear(self, create_genesis_block=False, autosave=True):
+        # subscribers keep listening to the same blockchain after it is cleared
+        tip_events = self.tip_events
+
         self.__init__(self.BLOCKCHAIN_ID,
-                      create_genesis_block=create_genesis_block, autosave=autosave, file=self.blockchain_file)
+                      create_genesis_block=create_genesis_block, autosave=autosave, file=self.blockchain_file,
+                      storage_config=self.storage_config, storage=self.storage, mempool_config=self.mempool_config,
+                      signature_verifier=self.signature_verifier)
+
+        self.tip_events = tip_events
+        self.tip_events.publish((self.height, self.previous_hash))
@@ -0,0 +1,132 @@
+import json
+
+from .serialization import encode_binary
+from .version import PROTOCOL_VERSION
+
+# canonical forms blocks and transactions are hashed and signed in
+JSON = "json"
+BINARY = "binary"
+
+# the canonical form of each protocol version. changing the form changes every
+# hash and signature, so it can only happen together with a new protocol version
+CANONICAL_FORMS = {
+    "0.2.0": JSON
+}
+
+# fields that are not covered by the hash (or signature) of a block or transaction
+BLOCK_UNHASHED = ("hash",)
+TRANSACTION_UNHASHED = ("id", "signature")
+
+# stands in for the nonce while a block template is split around it, it can't be valid hex
+NONCE_MARKER = "<nonce>"
+
+
+def canonical_form(protocol_version=None):
+    """
+    Gets the canonical form used by a protocol version
+
+    :param str protocol_version: The protocol version, None for the version this node runs
+    :return str form: JSON or BINARY
+    """
+    return CANONICAL_FORMS.get(protocol_version or PROTOCOL_VERSION, JSON)
+
+
+def plain(value):
+    # blocks and transactions are encoded as the dicts they stand for
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def sorted_value(value):
+    if isinstance(value, dict) or hasattr(value, "raw_items"):
+        items = value.items() if isinstance(value, dict) else value.raw_items()
+        return {key: sorted_value(item) for key, item in sorted(items)}
+    elif isinstance(value, (list, tuple)):
+        return [sorted_value(item) for item in value]
+
+    return value
+
+
+def encode_canonical(value, form=JSON, exclude=()):
+    """
+    Encodes a block or transaction in a canonical form, the bytes that are hashed and signed
+
+    :param value: The block or transaction, as a dict or record
+    :param str form: JSON (sorted keys, the legacy form) or BINARY (sorted keys, compact binary)
+    :param tuple exclude: Top level keys to leave out
+    :return bytes data: The encoded value
+    """
+    value = {key: item for key, item in value.items() if key not in exclude}
+
+    if form == JSON:
+        return json.dumps(value, sort_keys=True, default=plain).encode()
+    elif form == BINARY:
+        return encode_binary(sorted_value(value))
+    else:
+        raise ValueError(f"Unknown canonical form: {form}")
+
+
+def encode_nonce(nonce, form=JSON):
+    """
+    Encodes a nonce the way it appears inside a canonical block
+
+    :param str nonce: The nonce, a hex string
+    :param str form: The canonical form
+    :return bytes data: The encoded nonce
+    """
+    # hex strings never need escaping in json
+    if form == JSON:
+        return b'"' + nonce.encode() + b'"'
+
+    return encode_binary(nonce)
+
+
+def nonce_layout(block):
+    """
+    Splits the canonical encoding of a block template around its nonce, so
+    mining only has to hash the bytes that change between attempts
+
+    :param dict block: The block template
+    :return tuple layout: (form, prefix, suffix), the block bytes are prefix + encode_nonce(nonce, form) + suffix
+    """
+    form = canonical_form(block.get("protocol_version"))
+
+    template = dict(block.items())
+    template["nonce"] = NONCE_MARKER
+    data = encode_canonical(template, form, BLOCK_UNHASHED)
+
+    marker = json.dumps(NONCE_MARKER).encode() if form == JSON else encode_binary(NONCE_MARKER)
+    position = data.index(marker)
+
+    return form, data[:position], data[position + len(marker):]
+
+
+def block_bytes(block):
+    """
+    Gets the bytes a block hash is calculated from, in the canonical form of the block's protocol version
+
+    :param block: The block, as a dict or Block
+    :return bytes data: The encoded block without its hash
+    """
+    form = canonical_form(block.get("protocol_version"))
+    if hasattr(block, "canonical_bytes"):
+        return block.canonical_bytes(form)
+
+    return encode_canonical(block, form, BLOCK_UNHASHED)
+
+
+def transaction_bytes(transaction, form=None):
+    """
+    Gets the bytes a txid and signature are calculated from
+
+    :param transaction: The transaction, as a dict or Transaction
+    :param str form: The canonical form, None for the form of this node's protocol version
+    :return bytes data: The encoded transaction without its id and signature
+    """
+    form = form or canonical_form()
+    if hasattr(transaction, "canonical_bytes"):
+        return transaction.canonical_bytes(form)
+
+    return encode_canonical(transaction, form, TRANSACTION_UNHASHED)
@@ -0,0 +1,65 @@
+class ChainState:
+    """
+    Values derived from the chain tip. They are updated as blocks are added
+    instead of being recounted from the whole chain.
+    """
+
+    INITIAL_REWARD = 5
+    HALVING_INTERVAL = 100000
+
+    def __init__(self, target):
+        self.height = None
+        self.tip_hash = None
+        self.block_reward = self.INITIAL_REWARD
+        self.target = target
+        self.supply = 0.0
+        self.work = 0
+
+    def to_dict(self):
+        return {
+            "height": self.height,
+            "tip_hash": self.tip_hash,
+            "block_reward": self.block_reward,
+            "supply": self.supply,
+            "work": self.work
+        }
+
+    @classmethod
+    def from_dict(cls, data, target):
+        state = cls(target)
+        state.height = data["height"]
+        state.tip_hash = data["tip_hash"]
+        state.block_reward = data["block_reward"]
+        state.supply = data["supply"]
+        state.work = data["work"]
+
+        return state
+
+    @classmethod
+    def reward_at(cls, height):
+        """
+        Gets the reward for the block mined on top of the given height
+
+        :param int height: Height of the chain tip
+        :return float reward: The block reward
+        """
+        reward = cls.INITIAL_REWARD
+        for _ in range(max(0, (height - 1) // cls.HALVING_INTERVAL)):
+            reward *= 0.5
+
+        return reward
+
+    def apply_block(self, block):
+        # expected number of hashes needed to find a block at this target, worked out
+        # first so a bad target leaves the state untouched
+        work = 2**256 // (int(block["target"], 16) + 1)
+
+        self.height = block["height"]
+        self.tip_hash = block["hash"]
+        self.block_reward = self.reward_at(self.height)
+
+        for transaction in block["transactions"]:
+            if transaction["type"] == "coinbase":
+                self.supply += transaction["amount"]
+
+        self.work += work
@@ -4,16 +4,21 @@ from threading import Thread
 from time import time
 
 from .blockchain import Blockchain
+from .events import Notifier
 from .logger import Logger
+from .verification import shared_verifier
 
 
 class Consensus:
 
-    def __init__(self, blockchain, connection_pool):
+    def __init__(self, blockchain, connection_pool, verifier=None):
         self.blockchain = blockchain
         self.connection_pool = connection_pool
         self.logger = Logger("consensus")
 
+        # never started from the consensus thread, see ChainVerifier
+        self.verifier = verifier or shared_verifier()
+
         self.block_batch_size = 50
 
         self.sync_status = {
@@ -24,6 +29,9 @@ class Consensus:
             "speed": 0
         }
 
+        # published with True when a sync starts and False when it ends
+        self.sync_events = Notifier(False)
+
     @staticmethod
     def get_json(node, url):
         try:
@@ -44,6 +52,14 @@ class Consensus:
             if block:
                 break
 
+        # anything but a block is bad data from the node
+        if not isinstance(block, dict):
+            return None
+
+        # pruned nodes only have the header of old blocks
+        if block.get("status") == "pruned":
+            return None
+
         return block
 
     def download_block_threaded(self, node, blockhash, return_list, block_number):
@@ -56,7 +72,25 @@ class Consensus:
 
     def sync_blockchain(self, blockchain, blockinv, node):
         blockchain.autosave = False
+        self.sync_events.publish(True)
 
+        try:
+            self.download_batches(blockchain, blockinv, node)
+        finally:
+            # whatever was added before a failure is kept
+            blockchain.save()
+            blockchain.autosave = True
+
+            self.sync_status["syncing"] = False
+            self.sync_status["download_node"] = None
+            self.sync_status["progress"] = [0, 0]
+            self.sync_status["process"] = None
+            self.sync_status["speed"] = 0
+            self.sync_events.publish(False)
+
+        return blockchain
+
+    def download_batches(self, blockchain, blockinv, node):
         # set to sync mode
         node_block_height = len(blockinv) - 1
 
@@ -65,8 +99,6 @@ class Consensus:
         self.sync_status["progress"][1] = node_block_height
         self.sync_status["process"] = "batching block inventory"
 
-        invalid_chain = False
-
         if blockchain.last_block and blockchain.last_block["hash"] in blockinv:
             blockinv = blockinv[blockchain.height:-1]
 
@@ -102,31 +134,35 @@ class Consensus:
             end_time = time()
             self.sync_status["speed"] = round(((end_time - start_time) / self.block_batch_size) * 100, 2)
 
-            for block in blocks:
-                if not block:
-                    return blockchain
+            # only the blocks before a failed download can be added
+            incomplete = None in blocks
+            if incomplete:
+                blocks = blocks[:blocks.index(None)]
 
+            # check hashes and signatures of the whole batch in parallel before adding the blocks in order
+            self.sync_status["process"] = "verifying blocks"
+            failure = self.verifier.verify(blocks)
+            if failure:
+                self.logger.info(f"Block #{blocks[failure[0]]['height']} is invalid: {failure[1]}")
+                incomplete = True
+                blocks = blocks[:failure[0]]
+
+            for block in blocks:
                 self.sync_status["progress"][0] = block["height"] + 1
 
-                if not blockchain.add(block, verbose=True):
-                    return blockchain
+                if not blockchain.add(block, verbose=True, prechecked=True):
+                    return
+
+            if incomplete:
+                return
 
-            if i % 10 == 1:
-                blockchain.save()
+            # one save per batch, so the whole batch shares a single commit
+            blockchain.save()
 
             self.sync_status["syncing"] = True
             self.sync_status["download_node"] = node
             self.sync_status["progress"][1] = node_block_height
 
-        self.sync_status["syncing"] = False
-        self.sync_status["download_node"] = None
-        self.sync_status["progress"] = [0, 0]
-        self.sync_status["process"] = None
-        self.sync_status["speed"] = 0
-
-        blockchain.autosave = True
-        return blockchain
-
     def in_batches(self, items, size):
         batches = []
         current_batch = []
@@ -143,7 +179,8 @@ class Consensus:
 
     def download_new_blockchain(self, node, blockinv):
         new_blockchain = Blockchain(
-            self.blockchain.BLOCKCHAIN_ID, create_genesis_block=False, autosave=False)
+            self.blockchain.BLOCKCHAIN_ID, create_genesis_block=False, autosave=False, file=None,
+            signature_verifier=self.blockchain.signature_verifier)
 
         new_blockchain = self.sync_blockchain(new_blockchain, blockinv, node)
 
@@ -154,23 +191,26 @@ class Consensus:
             self.blockchain.clear(autosave=False)
             self.sync_status["process"] = "adding blocks to blockchain"
 
+            # the blocks were fully validated when they were added to new_blockchain
             for block in new_blockchain.chain:
-                if not self.blockchain.add(block, verbose=True):
+                if not self.blockchain.add(block, verbose=True, prechecked=True):
                     self.blockchain.clear(
                         create_genesis_block=True)
                     self.logger.info(
                         "Cleared blockchain due to fraudulent blocks.")
                     return False
 
-                if block["height"] % 1000 == 1:
+                if block["height"] % self.block_batch_size == 0:
                     self.blockchain.save()
 
+            self.blockchain.save()
+
         self.blockchain.autosave = True
         return True
 
     def download_latest_block(self, node):
         block = self.get_json(node, "/latest-block")
-        if not block:
+        if not isinstance(block, dict):
             return False
 
         if not self.blockchain.add(block):
@@ -183,7 +223,16 @@ class Consensus:
         for node in self.connection_pool.get_alive_peers(20):
             # get the  node information
             node_info = self.get_json(node, "/info")
-            if not node_info:
+            if not isinstance(node_info, dict):
+                continue
+
+            # skip nodes sending bad data
+            prune_height = node_info.get("prune_height", 0)
+            if not isinstance(prune_height, int) or not isinstance(node_info.get("block_height"), int):
+                continue
+
+            # a pruned node can't send the blocks below its prune height
+            if prune_height > (self.blockchain.height or 0) + 1:
                 continue
 
             if node_info["block_height"] > best_block_height:
@@ -239,5 +288,4 @@ class Consensus:
                 if not pending_transactions:
                     continue
 
-                for transaction in pending_transactions:
-                    self.blockchain.transaction_pool.add(transaction)
+                self.blockchain.transaction_pool.add_many(pending_transactions)
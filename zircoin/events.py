@@ -0,0 +1,59 @@
+from threading import Condition
+
+
+class Notifier:
+    """
+    Holds the latest value of something that changes (the chain tip, the
+    sync state) and tells subscribers about every change. Threads can
+    block until the value matches what they are waiting for.
+    """
+
+    def __init__(self, value=None):
+        self.value = value
+        self.condition = Condition()
+        self.subscribers = []
+
+    def publish(self, value):
+        """
+        Sets the value, wakes up waiting threads and calls the subscribers
+
+        :param value: The new value
+        """
+        with self.condition:
+            self.value = value
+            self.condition.notify_all()
+
+        # called on the publishing thread, so subscribers have to return quickly
+        for callback in list(self.subscribers):
+            callback(value)
+
+    def subscribe(self, callback):
+        """
+        :param callback: Called with the new value after every change
+        :return callback: The callback, to unsubscribe it later
+        """
+        self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def wake(self):
+        """
+        Wakes up waiting threads without changing the value, so they check
+        their predicate again (for example after being asked to stop)
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Blocks until the value matches
+
+        :param predicate: Called with the value, returns True once it is the one waited for
+        :param float timeout: Seconds to wait at most, None to wait forever
+        :return bool matched: False if the timeout ran out first
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: predicate(self.value), timeout)
@@ -0,0 +1,82 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class AddressIndex:
+    """
+    Maps each public key to the transactions it sent or received. Positions
+    are packed into a single int: (block height << 32) | transaction position.
+    """
+
+    def __init__(self, positions=None):
+        self.positions = positions if positions is not None else {}
+
+    @staticmethod
+    def pack(height, position):
+        return (height << 32) | position
+
+    @staticmethod
+    def unpack(packed):
+        return packed >> 32, packed & 0xffffffff
+
+    def apply_block(self, height, block):
+        for position, transaction in enumerate(block["transactions"]):
+            packed = self.pack(height, position)
+
+            self.positions.setdefault(transaction["sender"], []).append(packed)
+            if transaction["receiver"] != transaction["sender"]:
+                self.positions.setdefault(transaction["receiver"], []).append(packed)
+
+    @property
+    def addresses(self):
+        return self.positions.keys()
+
+    def first(self, positions, start_height):
+        # positions are added in chain order, so the ones below start_height come first
+        return bisect_left(positions, self.pack(start_height, 0)) if start_height else 0
+
+    def count(self, public_key, start_height=0):
+        positions = self.positions.get(public_key, ())
+        return len(positions) - self.first(positions, start_height)
+
+    def get(self, public_key, offset=0, limit=None, start_height=0):
+        """
+        Gets the positions of the transactions a public key is involved in, oldest first
+
+        :param str public_key: The wallet to look up
+        :param int offset: Number of transactions to skip
+        :param int limit: Maximum number of positions to return, None for all
+        :param int start_height: Leave out transactions in blocks below this height
+        :return list positions: (height, position) tuples
+        """
+        positions = self.positions.get(public_key, [])
+        start = self.first(positions, start_height) + offset
+        stop = None if limit is None else start + limit
+
+        return [self.unpack(packed) for packed in positions[start:stop]]
+
+
+class TimeIndex:
+    """
+    Block times in chain order. validate rejects blocks older than the
+    previous one, so the times are sorted and ranges can be found with bisect.
+    """
+
+    def __init__(self, times=None):
+        self.times = array("d", times or ())
+
+    def apply_block(self, block):
+        self.times.append(block["time"])
+
+    def range(self, since=None, until=None):
+        """
+        Finds the heights of the blocks mined after since and up to until
+
+        :param float since: Only include blocks with a later time, None for no lower bound
+        :param float until: Only include blocks with this time or earlier, None for no upper bound
+        :return tuple heights: (start, stop) heights, for slicing the chain
+        """
+        start = 0 if since is None else bisect_right(self.times, since)
+        stop = len(self.times) if until is None else bisect_right(self.times, until)
+
+        return start, max(start, stop)
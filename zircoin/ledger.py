@@ -0,0 +1,16 @@
+class Ledger:
+    def __init__(self):
+        self.balances = {}
+
+    def apply_transaction(self, transaction):
+        amount = transaction["amount"]
+
+        self.balances[transaction["receiver"]] = self.get_balance(transaction["receiver"]) + amount
+        self.balances[transaction["sender"]] = self.get_balance(transaction["sender"]) - amount
+
+    def apply_block(self, block):
+        for transaction in block["transactions"]:
+            self.apply_transaction(transaction)
+
+    def get_balance(self, public_key):
+        return self.balances.get(public_key, 0.0)
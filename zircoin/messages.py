@@ -1,6 +1,8 @@
 import requests
 import json
 
+from .canonical import plain
+
 connection_errors = (
     requests.exceptions.ConnectionError,
     requests.exceptions.Timeout,
@@ -18,7 +20,7 @@ def broadcast_block(block, connection_pool, blockchain):
 
     for peer in peers:
         try:
-            requests.post(peer + "/block-recv", json.dumps(block))
+            requests.post(peer + "/block-recv", json.dumps(block, default=plain))
         except connection_errors:
             continue
 
@@ -27,6 +29,6 @@ def broadcast_transaction(transaction, connection_pool):
 
     for peer in peers:
         try:
-            requests.post(peer + "/tx-recv", json.dumps(transaction))
+            requests.post(peer + "/tx-recv", json.dumps(transaction, default=plain))
         except connection_errors:
             continue
\ No newline at end of file
@@ -1,29 +1,91 @@
+from time import time
+from threading import Event
+
 from .logger import Logger
 from .messages import broadcast_block
-from time import time, sleep
+from .mining import MiningEngine
+from .telemetry import MiningStats, MINED, STALE, REJECTED
 logger = Logger("miner")
 
 
+def block_outcome(blockchain, block, timeout=5):
+    """
+    Waits for a broadcast or added block to show up in the chain
+
+    :param Blockchain blockchain: The blockchain the block was mined on
+    :param dict block: The mined block
+    :param float timeout: Seconds to wait for the block to be accepted
+    :return str outcome: MINED if the block is in the chain, STALE if another block
+                         at the same height got in first, REJECTED if it was refused
+    """
+    height = block["height"]
+    blockchain.tip_events.wait_for(lambda tip: tip[0] is not None and tip[0] >= height, timeout=timeout)
+
+    if blockchain.contains_hash(block["hash"]):
+        return MINED
+
+    return STALE if blockchain.height >= height else REJECTED
+
+
 class Miner:
-    def __init__(self, blockchain, config, consensus, connection_pool, verbose=True):
+    def __init__(self, blockchain, config, consensus, connection_pool, verbose=True, stats=None, pool=None):
         self.blockchain = blockchain
         self.config = config
         self.consensus = consensus
         self.connection_pool = connection_pool
 
+        # worker processes forked on the main thread at startup, see MiningPool
+        self.pool = pool
+
         self.verbose = verbose
+        self.stats = stats or MiningStats()
 
-    def mine(self, wallet):
-        if self.verbose: logger.info("⛏  Mining now...")
-        while True:
+        self.engine = None
+        self.stopping = Event()
+
+    def mine(self, wallet, workers=None):
+        """
+        Mines blocks until interrupted or stopped
+
+        :param Wallet wallet: Wallet the block rewards are paid to
+        :param int workers: Number of mining processes, 0 for one per core, None to use the config.
+                            Ignored if the miner was given a pool.
+        """
+        if workers is None:
+            workers = self.config.get("mining", {}).get("workers", 1)
+
+        self.stopping.clear()
+        engine = self.engine = MiningEngine(workers, stats=self.stats, pool=self.pool)
+        if self.verbose: logger.info(f"⛏  Mining now with {engine.workers} worker(s)...")
+        try:
+            self.mine_blocks(wallet, engine)
+        finally:
+            engine.close()
+            self.engine = None
+
+    def stop(self):
+        """
+        Stops mining from another thread, the block being mined is given up
+        """
+        self.stopping.set()
+        self.consensus.sync_events.wake()
+        if self.engine:
+            self.engine.stop()
+
+    def mine_blocks(self, wallet, engine):
+        while not self.stopping.is_set():
             try:
-                if self.consensus.sync_status["syncing"]:
+                if self.consensus.sync_events.value:
                     if self.verbose: logger.info("Waiting for blockchain sync to complete...")
-                    while self.consensus.sync_status["syncing"]:
-                        sleep(0.5)
+                    waiting = time()
+                    # stop() wakes this up, so there is no need to poll
+                    self.consensus.sync_events.wait_for(lambda syncing: not syncing or self.stopping.is_set())
+                    if self.stopping.is_set():
+                        return
+                    self.stats.record_sync_wait(time() - waiting)
                     if self.verbose: logger.info("Sync completed.")
 
-                block = self.blockchain.mine_new_block(wallet)
+                block = self.blockchain.mine_new_block(wallet, engine=engine)
                 if not block:
                     continue
 
@@ -32,21 +94,15 @@ class Miner:
                 else:
                     broadcast_block(block, self.connection_pool, self.blockchain)
 
-                mined_block = True
-                height = block["height"]
-                _hash = block["hash"]
-
                 # if the block is not accepted in 5 seconds, start mining a new block
-                timeout = time() + 5
-                while not self.blockchain.contains_hash(block["hash"]):
-                    if time() >= timeout or self.blockchain.height > block["height"]:
-                        if self.verbose: logger.info(f"✗ Block #{height} not accepted")
-                        mined_block = False
-                        break
-
-                if mined_block:
+                outcome = block_outcome(self.blockchain, block)
+                self.stats.record_block(outcome)
+
+                if outcome == MINED:
                     if self.verbose: logger.info(
-                        f"✓ Mined block #{height} ({_hash})")
+                        f"✓ Mined block #{block['height']} ({block['hash']}) at {round(engine.hashrate)} H/s")
+                elif self.verbose:
+                    logger.info(f"✗ Block #{block['height']} not accepted ({outcome})")
 
             except KeyboardInterrupt:
                 break
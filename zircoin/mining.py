@@ -0,0 +1,240 @@
+import os
+import signal
+from time import time
+from random import getrandbits
+from hashlib import sha256
+from threading import Event
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from .canonical import encode_nonce, nonce_layout
+from .telemetry import MiningStats, STALE
+from .verification import pool_context
+
+# set by the engine when the nonce ranges being searched are no longer needed
+cancelled = None
+
+
+def init_worker(event):
+    global cancelled
+    cancelled = event
+
+    # the workers share the terminal's process group, Ctrl+C (such as leaving the live stats view)
+    # is meant for the main process, which stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def search_nonces(template, target, start, count, check_every=2048, cancel=None):
+    """
+    Tries the nonces in a range on a block template
+
+    :param dict template: The block to mine, without its nonce and hash
+    :param str target: The hash has to be below this target
+    :param int start: First nonce to try
+    :param int count: Number of nonces to try
+    :param int check_every: Check whether the search was cancelled after this many attempts
+    :param Event cancel: Stops the search when set, defaults to the event the worker process was started with
+    :return tuple result: (nonce, hash) of the block that was found or None, and the number of attempts made
+    """
+    form, prefix, suffix = nonce_layout(template)
+    return search_layout(form, prefix, suffix, target, start, count, check_every, cancel)
+
+
+def search_layout(form, prefix, suffix, target, start, count, check_every=2048, cancel=None):
+    """
+    Tries the nonces in a range on a template that was already split with canonical.nonce_layout,
+    takes the same arguments as search_nonces
+    """
+    cancel = cancel or cancelled
+
+    # the part of the block before the nonce is hashed once, every attempt continues from a copy of that state
+    prefix_state = sha256(prefix)
+
+    # for 64 digit targets comparing raw digests is the same as comparing the hex strings
+    raw_target = bytes.fromhex(target) if len(target) == 64 else None
+
+    for attempts, nonce in enumerate(range(start, start + count)):
+        if attempts % check_every == 0 and cancel is not None and cancel.is_set():
+            return None, attempts
+
+        nonce = format(nonce, "x")
+        state = prefix_state.copy()
+        state.update(encode_nonce(nonce, form) + suffix)
+        digest = state.digest()
+
+        if digest < raw_target if raw_target is not None else digest.hex() < target:
+            return (nonce, digest.hex()), attempts + 1
+
+    return None, count
+
+
+class MiningPool:
+    """
+    The worker processes a MiningEngine hashes with. They are forked when
+    the pool is created, so a node creates its pool on the main thread
+    before the server, consensus and miner threads start (a thread holding
+    a lock while another one forks can deadlock the children) and hands it
+    to the Miner.
+    """
+
+    def __init__(self, workers=1):
+        """
+        :param int workers: Number of worker processes, None or 0 for one per core, 1 hashes on the calling thread
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+        self.cancel_event = Event()
+
+        if self.workers > 1 and pool_context():
+            context = pool_context()
+            self.cancel_event = context.Event()
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                initializer=init_worker, initargs=(self.cancel_event,))
+            # a fork pool starts all of its workers on the first submit, do that now instead of on first use
+            self.executor.submit(os.getpid).result()
+
+    def close(self):
+        self.cancel_event.set()
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+class MiningEngine:
+    """
+    Splits the nonce search for a block across worker processes. Every
+    worker gets the block template and its own nonce range, and the
+    search is cancelled as soon as the chain tip moves.
+    """
+
+    def __init__(self, workers=1, range_size=20000, template_lifetime=10, stats=None, pool=None):
+        """
+        :param int workers: Number of worker processes, None or 0 for one per core, ignored if a pool is given
+        :param int range_size: Number of nonces handed to a worker at a time
+        :param float template_lifetime: Seconds before the template is rebuilt to pick up new transactions
+        :param MiningStats stats: Records attempts, template builds and stale blocks
+        :param MiningPool pool: Worker processes started earlier, a new pool is started if None
+        """
+        self.own_pool = pool is None
+        self.pool = pool or MiningPool(workers)
+        self.workers = self.pool.workers
+        self.range_size = range_size
+        self.template_lifetime = template_lifetime
+        self.stats = stats or MiningStats()
+
+        self.hashrate = 0
+        self.stopped = False
+        self.executor = self.pool.executor
+        self.cancel_event = self.pool.cancel_event
+
+    def mine(self, blockchain, wallet):
+        """
+        Mines a block on top of the current chain tip
+
+        :param Blockchain blockchain: The blockchain to mine on
+        :param Wallet wallet: Wallet the block reward is paid to
+        :return dict block: The mined block, or None if the tip changed first or the engine was stopped
+        """
+        if self.stopped:
+            return None
+
+        self.cancel_event.clear()
+
+        # stale work is dropped the moment another block is added
+        subscription = blockchain.tip_events.subscribe(lambda tip: self.cancel_event.set())
+
+        self.stats.watch(blockchain)
+
+        tip = blockchain.previous_hash
+        build_started = time()
+        template = blockchain.make_block(wallet)
+        template.pop("hash")
+        created = time()
+        self.stats.record_template(created - build_started)
+
+        nonce = getrandbits(64)
+        attempts = 0
+        started = time()
+        result = None
+
+        def tip_changed():
+            return blockchain.previous_hash != tip
+
+        def expired():
+            return time() - created > self.template_lifetime
+
+        def next_range():
+            nonlocal nonce
+            start = nonce
+            nonce += self.range_size
+            return start
+
+        try:
+            if not self.executor:
+                while not result and not self.cancel_event.is_set() and not tip_changed() and not expired():
+                    result, tried = search_nonces(template, blockchain.target, next_range(), self.range_size,
+                                                  cancel=self.cancel_event)
+                    attempts += tried
+                    self.stats.record_attempts(tried)
+                    self.update_hashrate(attempts, started)
+            else:
+                pending = {self.executor.submit(search_nonces, template, blockchain.target, next_range(),
+                                                self.range_size) for _ in range(self.workers)}
+
+                while pending:
+                    # workers return early once the cancel event is set, so this only times out to expire the
+                    # template. once cancelled there is nothing left to time out, the ranges drain on their own
+                    if self.cancel_event.is_set():
+                        timeout = None
+                    else:
+                        timeout = max(0, self.template_lifetime - (time() - created))
+                    done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        found, tried = future.result()
+                        attempts += tried
+                        self.stats.record_attempts(tried)
+                        result = result or found
+
+                    self.update_hashrate(attempts, started)
+
+                    if result or self.cancel_event.is_set() or tip_changed() or expired():
+                        self.cancel_event.set()
+                        continue
+
+                    for _ in done:
+                        pending.add(self.executor.submit(search_nonces, template, blockchain.target,
+                                                         next_range(), self.range_size))
+        finally:
+            blockchain.tip_events.unsubscribe(subscription)
+            self.cancel_event.set()
+
+        if not result:
+            return None
+
+        if tip_changed():
+            # found, but another block was added while searching
+            self.stats.record_block(STALE)
+            return None
+
+        block = dict(template)
+        block["nonce"], block["hash"] = result
+
+        return block
+
+    def update_hashrate(self, attempts, started):
+        elapsed = time() - started
+        if elapsed > 0:
+            self.hashrate = attempts / elapsed
+
+    def stop(self):
+        # gives up on the current template, and mine returns None from now on
+        self.stopped = True
+        self.cancel_event.set()
+
+    def close(self):
+        self.cancel_event.set()
+        self.executor = None
+
+        # a pool that was handed in outlives the engine
+        if self.own_pool:
+            self.pool.close()
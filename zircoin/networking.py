@@ -1,8 +1,11 @@
 from aiohttp import web
+from functools import partial
 import requests
 import json
 
 from .logger import Logger
+from .canonical import plain
+from .telemetry import MiningStats
 from .version import (
     PROTOCOL_VERSION,
     NETWORKING_VERSION,
@@ -11,9 +14,12 @@ from .version import (
 
 logger = Logger("networking")
 
+# blocks are stored as Block objects, so responses need to know how to encode them
+dumps = partial(json.dumps, default=plain)
+
 
 class HttpRoutes:
-    def __init__(self, blockchain, connection_pool, server_config, config, NODE_ID):
+    def __init__(self, blockchain, connection_pool, server_config, config, NODE_ID, mining_stats=None):
         self.server_config = server_config
         self.main_config = config
         self.blockchain = blockchain
@@ -32,6 +38,12 @@ class HttpRoutes:
 
         self.NODE_ID = NODE_ID
 
+        # shared with the miner, which does the recording
+        self.mining_stats = mining_stats or MiningStats()
+
+        # encoded /blockinv response, keyed by the chain tip it was built for
+        self.blockinv_cache = (None, None)
+
     # AIOHTTP Routes
 
     def home_route(self, request):
@@ -39,14 +51,19 @@ class HttpRoutes:
 
     # returns blockchain
     def blockchain_route(self, request):
-        return web.json_response(self.blockchain.chain)
+        return web.json_response(list(self.blockchain.chain), dumps=dumps)
 
     def latest_block_route(self, request):
-        return web.json_response(self.blockchain.last_block)
+        return web.json_response(self.blockchain.last_block, dumps=dumps)
 
     # returns a list of block hashes
     def blockinv_route(self, request):
-        return web.json_response(self.blockchain.block_inv)
+        tip = (self.blockchain.height, self.blockchain.previous_hash)
+
+        if self.blockinv_cache[0] != tip:
+            self.blockinv_cache = (tip, json.dumps(self.blockchain.block_inv))
+
+        return web.Response(text=self.blockinv_cache[1], content_type="application/json")
 
     # returns peer info
     def info_route(self, request):
@@ -54,10 +71,19 @@ class HttpRoutes:
             "protocol_version": self.PROTOCOL_VERSION,
             "networking_version": self.NETWORKING_VERSION,
             "block_height": self.blockchain.height,
+            "prune_height": self.blockchain.prune_height,
+            "target": self.blockchain.target,
+            "pending_transactions": len(self.blockchain.transaction_pool.transactions),
+            "pending_bytes": self.blockchain.transaction_pool.size,
+            "unconfirmed_transactions": len(self.blockchain.transaction_pool.unconfirmed),
             "node_id": self.NODE_ID,
             "blockchain_id": self.main_config["blockchain_id"]
         })
 
+    # returns the miner's telemetry
+    def mining_stats_route(self, request):
+        return web.json_response(self.mining_stats.snapshot())
+
     # adds the pinging peer to the connection pool
     async def ping_route(self, request):
         response = await request.json()
@@ -73,11 +99,11 @@ class HttpRoutes:
 
     # returns list of pending transactions
     def transactions_route(self, request):
-        return web.json_response(self.blockchain.transaction_pool.pool)
+        return web.json_response(self.blockchain.transaction_pool.pool, dumps=dumps)
 
     # returns a list of transactions that have been mined, but have not been validated yet.
     def unconfirmed_transactions_route(self, request):
-        return web.json_response(self.blockchain.transaction_pool.unconfirmed_pool)
+        return web.json_response(self.blockchain.transaction_pool.unconfirmed_pool, dumps=dumps)
 
     # endpoint for newly mined blocks to be sent to
     async def block_receive_route(self, request):
@@ -103,10 +129,50 @@ class HttpRoutes:
 
         return web.Response(text="received")
 
+    # returns the most recent blocks mined in a time range (?since=<ts>&until=<ts>&limit=<n>)
+    def blocks_route(self, request):
+        try:
+            since = float(request.query["since"]) if "since" in request.query else None
+            until = float(request.query["until"]) if "until" in request.query else None
+            limit = min(max(1, int(request.query.get("limit", 100))), 1000)
+        except ValueError:
+            return web.Response(text="Invalid since, until or limit", status=400)
+
+        start, stop = self.blockchain.time_index.range(since, until)
+        return web.json_response(self.blockchain.chain[max(start, stop - limit):stop], dumps=dumps)
+
+    # returns a page of the transactions sent or received by a wallet
+    def address_transactions_route(self, request):
+        public_key = request.match_info.get("public_key")
+
+        try:
+            offset = max(0, int(request.query.get("offset", 0)))
+            limit = min(max(1, int(request.query.get("limit", 100))), 1000)
+        except ValueError:
+            return web.Response(text="Invalid offset or limit", status=400)
+
+        return web.json_response({
+            "public_key": public_key,
+            # transactions in pruned blocks can't be sent, so they aren't counted
+            "total": self.blockchain.address_index.count(public_key, self.blockchain.prune_height),
+            "first_available_height": self.blockchain.prune_height,
+            "offset": offset,
+            "limit": limit,
+            "transactions": self.blockchain.get_transaction_history(public_key, offset, limit)
+        }, dumps=dumps)
+
     # returns the block associated with said hash
     def block_route(self, request):
         block_hash = request.match_info.get("blockhash")
         block = self.blockchain.get_block_from_hash(block_hash)
+        if block and block.get("pruned"):
+            return web.json_response({
+                "status": "pruned",
+                "hash": block_hash,
+                "height": block["height"],
+                "prune_height": self.blockchain.prune_height
+            }, status=410)
+
         if block:
-            return web.json_response(block)
+            return web.json_response(block, dumps=dumps)
 
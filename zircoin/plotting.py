@@ -18,15 +18,11 @@ def wealth_distribution(blockchain):
     wallets = {}
     keys = []
 
-    for block in blockchain.chain:
-        for transaction in block["transactions"]:
-            wallets[transaction["receiver"]] = 0
-
-    for wallet in wallets:
-        bal = blockchain.get_balance(wallet)
-        if bal > 0:
-            wallets[wallet] = bal
+    for wallet, bal in blockchain.ledger.balances.items():
+        if wallet == "coinbase":
+            continue
 
+        wallets[wallet] = bal if bal > 0 else 0
         keys.append(f"{wallet[0:3]}...{wallet[-3:]}")
 
     fig1, ax1 = plt.subplots()
@@ -46,20 +42,18 @@ def transaction_volume(blockchain):
     wallets = {}
     keys = []
 
-    for block in blockchain.chain:
-        for transaction in block["transactions"]:
-            wallets[transaction["receiver"]] = 0
+    for wallet in blockchain.address_index.addresses:
+        if wallet == "coinbase":
+            continue
 
-    for wallet in wallets:
+        wallets[wallet] = 0
         bal = 0.0
 
-        for block in blockchain.chain:
-            for transaction in block["transactions"]:
-                if transaction["type"] == "coinbase":
-                    continue
+        for transaction in blockchain.get_transaction_history(wallet):
+            if transaction["type"] == "coinbase":
+                continue
 
-                if transaction["receiver"] == wallet or transaction["sender"] == wallet:
-                    bal += transaction["amount"]
+            bal += transaction["amount"]
         
         if bal > 0:
             wallets[wallet] = bal
@@ -0,0 +1,200 @@
+import struct
+
+# value tags
+NONE = 0
+FALSE = 1
+TRUE = 2
+INT = 3
+FLOAT = 4
+STRING = 5
+HEX = 6
+LIST = 7
+DICT = 8
+
+# keys used by blocks and transactions are written as a single byte
+KEYS = (
+    "amount", "blockchain_id", "hash", "height", "id", "nonce", "previous_hash", "protocol_version",
+    "receiver", "sender", "signature", "target", "time", "timestamp", "transactions", "type"
+)
+KEY_CODES = {key: code for code, key in enumerate(KEYS, start=1)}
+
+DOUBLE = struct.Struct("<d")
+
+
+def write_varint(out, number):
+    while number > 0x7f:
+        out.append((number & 0x7f) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def read_varint(data, position):
+    number = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+def write_string(out, text):
+    encoded = text.encode()
+    write_varint(out, len(encoded))
+    out += encoded
+
+
+def read_string(data, position):
+    length, position = read_varint(data, position)
+    return bytes(data[position:position + length]).decode(), position + length
+
+
+def as_hex_bytes(text):
+    # only lowercase hex survives the round trip unchanged, anything else is kept as a string
+    if not text or len(text) % 2:
+        return None
+
+    try:
+        raw = bytes.fromhex(text)
+    except ValueError:
+        return None
+
+    return raw if raw.hex() == text else None
+
+
+def write_value(out, value):
+    if value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        out.append(INT)
+        write_varint(out, (value << 1) if value >= 0 else ((-value) << 1) - 1)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += DOUBLE.pack(value)
+    elif isinstance(value, bytes):
+        out.append(HEX)
+        write_varint(out, len(value))
+        out += value
+    elif isinstance(value, str):
+        raw = as_hex_bytes(value)
+        if raw is None:
+            out.append(STRING)
+            write_string(out, value)
+        else:
+            out.append(HEX)
+            write_varint(out, len(raw))
+            out += raw
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        write_varint(out, len(value))
+        for item in value:
+            write_value(out, item)
+    elif isinstance(value, dict) or hasattr(value, "raw_items"):
+        # blocks and transactions hand over their hex fields as raw bytes
+        items = list(value.items() if isinstance(value, dict) else value.raw_items())
+        out.append(DICT)
+        write_varint(out, len(items))
+        for key, item in items:
+            code = KEY_CODES.get(key)
+            if code is None:
+                out.append(0)
+                write_string(out, key)
+            else:
+                out.append(code)
+            write_value(out, item)
+    else:
+        raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def read_field(data, position, key):
+    # only the fields of a record itself are packed as bytes, values nested inside them stay strings
+    tag = data[position]
+
+    if tag == HEX:
+        return read_value(data, position, raw_hex=True)
+    elif tag == LIST and key == "transactions":
+        count, position = read_varint(data, position + 1)
+        transactions = []
+        for _ in range(count):
+            transaction, position = read_value(data, position, raw_hex=True)
+            transactions.append(transaction)
+        return transactions, position
+
+    return read_value(data, position)
+
+
+def read_value(data, position, raw_hex=False):
+    tag = data[position]
+    position += 1
+
+    if tag == NONE:
+        return None, position
+    elif tag == TRUE:
+        return True, position
+    elif tag == FALSE:
+        return False, position
+    elif tag == INT:
+        number, position = read_varint(data, position)
+        return (number >> 1) if not number & 1 else -((number + 1) >> 1), position
+    elif tag == FLOAT:
+        return DOUBLE.unpack_from(data, position)[0], position + 8
+    elif tag == STRING:
+        return read_string(data, position)
+    elif tag == HEX:
+        length, position = read_varint(data, position)
+        raw = bytes(data[position:position + length])
+        return raw if raw_hex else raw.hex(), position + length
+    elif tag == LIST:
+        count, position = read_varint(data, position)
+        items = []
+        for _ in range(count):
+            item, position = read_value(data, position)
+            items.append(item)
+        return items, position
+    elif tag == DICT:
+        count, position = read_varint(data, position)
+        items = {}
+        for _ in range(count):
+            code = data[position]
+            position += 1
+            if code:
+                key = KEYS[code - 1]
+            else:
+                key, position = read_string(data, position)
+            if raw_hex:
+                items[key], position = read_field(data, position, key)
+            else:
+                items[key], position = read_value(data, position)
+        return items, position
+    else:
+        raise ValueError(f"Unknown value tag {tag}")
+
+
+def encode_binary(value):
+    """
+    Encodes a block, transaction or other json-like value into the compact binary format
+
+    :param value: The value to encode
+    :return bytes data: The encoded value
+    """
+    out = bytearray()
+    write_value(out, value)
+    return bytes(out)
+
+
+def decode_binary(data, position=0, raw_hex=False):
+    """
+    Decodes a value written by encode_binary
+
+    :param bytes data: Buffer holding the encoded value (bytes, memoryview or mmap)
+    :param int position: Offset of the value in the buffer
+    :param bool raw_hex: Return the hex fields of a block or transaction as raw bytes, ready for Block.from_dict
+    :return value: The decoded value
+    """
+    return read_value(data, position, raw_hex)[0]
@@ -23,6 +23,7 @@ class Server:
             web.get('/latest-block', self.http_routes.latest_block_route),
             web.get('/blockinv', self.http_routes.blockinv_route),
             web.get('/info', self.http_routes.info_route),
+            web.get('/mining/stats', self.http_routes.mining_stats_route),
             web.post('/ping', self.http_routes.ping_route),
             web.get('/peers', self.http_routes.peers_route),
             web.get('/pending-transactions', self.http_routes.transactions_route),
@@ -31,7 +32,9 @@ class Server:
             web.post('/block-recv', self.http_routes.block_receive_route),
             web.post('/tx-recv', self.http_routes.transaction_recieve_route),
 
-            web.get('/block/{blockhash}', self.http_routes.block_route)
+            web.get('/block/{blockhash}', self.http_routes.block_route),
+            web.get('/blocks', self.http_routes.blocks_route),
+            web.get('/address/{public_key}/transactions', self.http_routes.address_transactions_route)
         ])
 
         runner = web.AppRunner(self.app)
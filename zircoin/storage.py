@@ -0,0 +1,908 @@
+import os
+import json
+import mmap
+import struct
+import sqlite3
+from hashlib import sha256
+from time import monotonic
+from threading import RLock
+from collections import OrderedDict
+
+from .canonical import block_bytes, plain
+from .logger import Logger
+from .serialization import encode_binary, decode_binary
+from .structures import Block, block_header
+
+logger = Logger("storage")
+
+SYNCED = struct.Struct("<Q")
+
+
+def record_intact(block, block_hash):
+    """
+    Checks that a stored block still hashes to the hash it was indexed under,
+    which catches records that were torn or never reached the disk
+
+    :param dict block: The decoded block
+    :param str block_hash: The hash from the index
+    :return bool intact: True if the block is complete
+    """
+    # the genesis block is never hashed by the rules, and pruned blocks no longer hash to their hash
+    if block.get("height") == 0 or block.get("pruned"):
+        return block.get("hash") == block_hash
+
+    # the stored hash has to match too, a record with a damaged hash field would be rewritten by the next sync
+    if block.get("hash") != block_hash:
+        return False
+
+    # hashed the same way the rules hash it, in the canonical form of the block's protocol version
+    return sha256(block_bytes(block)).hexdigest() == block_hash
+
+
+class BlockStore:
+    # lazy stores serve blocks from disk through a LazyChain instead of a list
+    lazy = False
+
+    fsync_every = 0
+    fsync_interval = 0
+    unsynced = 0
+    unsynced_since = 0
+
+    def migrate(self):
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+
+        with open(self.legacy_file, "r") as f:
+            try:
+                blockchain = json.load(f)
+            except json.decoder.JSONDecodeError:
+                logger.error(f"{self.legacy_file} is not valid json, it was not migrated")
+                return
+
+        for block in blockchain:
+            self.append(block)
+        self.flush(fsync=True)
+
+        os.replace(self.legacy_file, self.legacy_file + ".migrated")
+        logger.info(f"Migrated {len(blockchain)} blocks from {self.legacy_file} to {self.path}")
+
+    def block_hashes(self, stop):
+        return [self.hash_at(height) for height in range(stop)]
+
+    def prune(self, start, stop):
+        """
+        Replaces the stored blocks in a height range with their headers
+
+        :param int start: First height that is not pruned yet
+        :param int stop: Height to prune up to (exclusive)
+        :return int height: Height the store is now pruned up to (exclusive), None if the store keeps full blocks
+        """
+        return None
+
+    def sync(self, chain):
+        """
+        Brings the store in line with the chain, only writing blocks that are
+        not stored yet. Blocks that are no longer in the chain are removed.
+
+        :param list chain: The blockchain to persist
+        """
+        self.open()
+
+        common = min(len(self), len(chain))
+        while common > 0 and self.hash_at(common - 1) != chain[common - 1]["hash"]:
+            common -= 1
+
+        if common < len(self):
+            self.truncate(common)
+
+        for block in chain[common:]:
+            self.append(block)
+
+        self.commit()
+
+    def appended(self):
+        if not self.unsynced:
+            self.unsynced_since = monotonic()
+        self.unsynced += 1
+
+    def commit(self):
+        """
+        Group commit: everything appended since the last commit is flushed
+        together, and a single fsync covers all of it once enough blocks or
+        enough time have built up
+        """
+        fsync = bool(self.fsync_every and self.unsynced >= self.fsync_every)
+        if self.fsync_interval and self.unsynced and monotonic() - self.unsynced_since >= self.fsync_interval:
+            fsync = True
+
+        self.flush(fsync=fsync)
+
+    def read_synced(self):
+        # number of blocks known to be on disk, the ones after it are checked when the store is opened
+        if not os.path.exists(self.synced_path):
+            return 0
+
+        with open(self.synced_path, "rb") as f:
+            data = f.read(SYNCED.size)
+
+        return SYNCED.unpack(data)[0] if len(data) == SYNCED.size else 0
+
+    def write_synced(self, count, fsync=False):
+        # only written after an fsync, so it can never cover blocks that aren't on disk.
+        # lowering it has to be durable, or blocks appended later would be trusted unchecked
+        with open(self.synced_path, "r+b" if os.path.exists(self.synced_path) else "wb") as f:
+            f.write(SYNCED.pack(count))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class LazyChain:
+    """
+    Sequence view of the blocks in a lazy store. Blocks are only decoded when
+    they are accessed, and the most recently used ones are kept in memory.
+    """
+
+    def __init__(self, store, cache_size=256):
+        self.store = store
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return self.read_range(start, stop) if start < stop else []
+            return [self[i] for i in range(start, stop, step)]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("block index out of range")
+
+        block = self.cache.get(index)
+        if block is None:
+            block = self.read_range(index, index + 1)[0]
+            self.remember(index, block)
+        else:
+            self.cache.move_to_end(index)
+
+        return block
+
+    def __iter__(self):
+        batch_size = 500
+        for start in range(0, len(self), batch_size):
+            yield from self.read_range(start, min(start + batch_size, len(self)))
+
+    def read_range(self, start, stop):
+        return [Block.from_dict(block) for block in self.store.read_range(start, stop)]
+
+    def remember(self, index, block):
+        self.cache[index] = block
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def append(self, block):
+        self.store.append(block)
+        self.remember(len(self) - 1, Block.from_dict(block))
+
+
+class SegmentStore(BlockStore):
+    """
+    Append-only block store. Blocks are written one per line to numbered
+    segment files, and a fixed size index records where each block lives.
+    """
+
+    # segment number, offset, length, block hash
+    INDEX_ENTRY = struct.Struct("<IQI32s")
+
+    # set on the segment number of blocks that were moved to a headers segment by pruning
+    PRUNED = 0x80000000
+
+    def __init__(self, path, legacy_file=None, segment_size=1000, fsync_every=1, fsync_interval=0):
+        """
+        :param str path: Directory the segments and index are stored in
+        :param str legacy_file: blockchain.json file to migrate from if the store is empty
+        :param int segment_size: Number of blocks per segment file
+        :param int fsync_every: Fsync on commit once this many blocks are waiting (0 leaves it to the OS)
+        :param float fsync_interval: Also fsync on commit once the oldest waiting block is this many seconds old
+        """
+        self.path = path
+        self.legacy_file = legacy_file
+        self.segment_size = segment_size
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self.entries = []
+        self.unsynced = 0
+        self.opened = False
+
+        self.index_file = None
+        self.segment_file = None
+        self.segment_number = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, "index.dat")
+
+    @property
+    def synced_path(self):
+        return os.path.join(self.path, "synced")
+
+    def segment_path(self, number):
+        if number & self.PRUNED:
+            return os.path.join(self.path, f"segment-{number & ~self.PRUNED:06d}.headers.jsonl")
+
+        return os.path.join(self.path, f"segment-{number:06d}.jsonl")
+
+    def open(self):
+        if self.opened:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        self.entries = self.read_index()
+        self.repair()
+
+        self.index_file = open(self.index_path, "ab")
+        self.opened = True
+
+        if not self.entries:
+            self.migrate()
+
+    def read_index(self):
+        entries = []
+        if not os.path.exists(self.index_path):
+            return entries
+
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+
+        size = self.INDEX_ENTRY.size
+        for start in range(0, len(data) - size + 1, size):
+            entries.append(self.INDEX_ENTRY.unpack_from(data, start))
+
+        return entries
+
+    def repair(self):
+        synced = min(self.read_synced(), len(self.entries))
+        torn = self.find_torn(synced)
+
+        if torn is not None:
+            logger.error(f"Block store is truncated at block {torn}, dropping the rest")
+            self.entries = self.entries[:torn]
+
+        # drop any data written after the last intact block
+        self.truncate_files(len(self.entries))
+        self.write_synced(len(self.entries), fsync=True)
+
+        # a prune interrupted after rewriting the index leaves the full segment behind
+        segments = {segment for segment, _, _, _ in self.entries}
+        for segment in segments:
+            full_segment = segment & ~self.PRUNED
+            if segment & self.PRUNED and full_segment not in segments and os.path.exists(self.segment_path(full_segment)):
+                os.remove(self.segment_path(full_segment))
+
+    def find_torn(self, synced):
+        """
+        Finds the first block that didn't fully reach the disk. Entries pointing
+        past the end of their segment are torn, and so are blocks written after
+        the last fsync that no longer match their hash.
+
+        :param int synced: Number of blocks known to be on disk
+        :return int height: Height of the first torn block, or None if every block is intact
+        """
+        segment_sizes = {}
+        for height, (segment, offset, length, _) in enumerate(self.entries):
+            if segment not in segment_sizes:
+                path = self.segment_path(segment)
+                segment_sizes[segment] = os.path.getsize(path) if os.path.exists(path) else 0
+
+            if offset + length > segment_sizes[segment]:
+                return height
+
+        segment, data = None, b""
+        for height in range(synced, len(self.entries)):
+            entry_segment, offset, length, block_hash = self.entries[height]
+            if entry_segment != segment:
+                segment = entry_segment
+                data = self.read_segment(segment)
+
+            try:
+                if not record_intact(json.loads(data[offset:offset + length]), block_hash.hex()):
+                    return height
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return height
+
+        return None
+
+    def truncate_files(self, height):
+        size = self.INDEX_ENTRY.size
+        if os.path.exists(self.index_path):
+            os.truncate(self.index_path, height * size)
+
+        if height < len(self.entries):
+            segment, offset, _, _ = self.entries[height]
+        elif self.entries:
+            segment, offset, length, _ = self.entries[-1]
+            offset += length
+        else:
+            segment, offset = 0, 0
+
+        if os.path.exists(self.segment_path(segment)):
+            os.truncate(self.segment_path(segment), offset)
+
+        segment = (segment & ~self.PRUNED) + 1
+        while True:
+            paths = [path for path in (self.segment_path(segment), self.segment_path(segment | self.PRUNED))
+                     if os.path.exists(path)]
+            if not paths:
+                break
+
+            for path in paths:
+                os.remove(path)
+            segment += 1
+
+    def hash_at(self, height):
+        return self.entries[height][3].hex()
+
+    def read_segment(self, number):
+        path = self.segment_path(number)
+        if not os.path.exists(path):
+            return b""
+
+        with open(path, "rb") as f:
+            return f.read()
+
+    def load(self):
+        """
+        Reads every stored block back into memory
+
+        :return list blocks: The stored blocks, in height order
+        """
+        self.open()
+
+        blocks = []
+        segment, data = None, b""
+        for entry_segment, offset, length, _ in self.entries:
+            if entry_segment != segment:
+                segment = entry_segment
+                data = self.read_segment(segment)
+
+            blocks.append(Block.from_dict(json.loads(data[offset:offset + length])))
+
+        return blocks
+
+    def append(self, block):
+        height = len(self.entries)
+        segment = height // self.segment_size
+
+        if segment != self.segment_number:
+            if self.segment_file:
+                self.segment_file.close()
+            self.segment_file = open(self.segment_path(segment), "ab")
+            self.segment_number = segment
+
+        record = json.dumps(block, separators=(",", ":"), default=plain).encode() + b"\n"
+        offset = self.segment_file.tell()
+        self.segment_file.write(record)
+
+        entry = (segment, offset, len(record), bytes.fromhex(block["hash"]))
+        self.index_file.write(self.INDEX_ENTRY.pack(*entry))
+        self.entries.append(entry)
+        self.appended()
+
+    def truncate(self, height):
+        """
+        Removes every block from the given height upwards
+
+        :param int height: The number of blocks to keep
+        """
+        if self.segment_file:
+            self.segment_file.close()
+            self.segment_file = None
+            self.segment_number = None
+        self.index_file.close()
+
+        if self.read_synced() > height:
+            self.write_synced(height, fsync=True)
+
+        self.truncate_files(height)
+        self.entries = self.entries[:height]
+
+        self.index_file = open(self.index_path, "ab")
+
+    def prune(self, start, stop):
+        """
+        Rewrites every whole segment below the stop height as a headers segment,
+        so the pruned height is always a multiple of the segment size.
+        The headers are written first, then the index entries are pointed at
+        them, and only then is the full segment deleted, so a crash at any
+        point leaves every entry pointing at a complete record.
+        """
+        self.open()
+        self.flush()
+
+        size = self.INDEX_ENTRY.size
+        for segment in range(start // self.segment_size, stop // self.segment_size):
+            first = segment * self.segment_size
+            entries = self.entries[first:first + self.segment_size]
+            if not entries or any(entry[0] & self.PRUNED for entry in entries):
+                continue
+
+            data = self.read_segment(segment)
+            headers_segment = segment | self.PRUNED
+
+            records = []
+            pruned_entries = []
+            offset = 0
+            for _, entry_offset, length, block_hash in entries:
+                header = block_header(json.loads(data[entry_offset:entry_offset + length]))
+                record = json.dumps(header, separators=(",", ":")).encode() + b"\n"
+                records.append(record)
+                pruned_entries.append((headers_segment, offset, len(record), block_hash))
+                offset += len(record)
+
+            with open(self.segment_path(headers_segment), "wb") as f:
+                f.write(b"".join(records))
+                f.flush()
+                os.fsync(f.fileno())
+
+            with open(self.index_path, "r+b") as f:
+                f.seek(first * size)
+                f.write(b"".join(self.INDEX_ENTRY.pack(*entry) for entry in pruned_entries))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.entries[first:first + len(pruned_entries)] = pruned_entries
+            os.remove(self.segment_path(segment))
+
+        return max(start, stop // self.segment_size * self.segment_size)
+
+    def flush(self, fsync=False):
+        # the segment has to reach the disk before the index entries pointing into it
+        for f in (self.segment_file, self.index_file):
+            if f:
+                f.flush()
+                if fsync:
+                    os.fsync(f.fileno())
+
+        if fsync and self.opened:
+            self.write_synced(len(self.entries))
+            self.unsynced = 0
+
+    def close(self):
+        if self.opened:
+            self.flush(fsync=True)
+
+
+class SqliteChain(LazyChain):
+    def address_transactions(self, public_key, offset=0, limit=None):
+        return self.store.address_transactions(public_key, offset, limit)
+
+
+class SqliteStore(BlockStore):
+    """
+    Keeps blocks and transactions in a SQLite database, with indexes on the
+    columns the node looks blocks and transactions up by.
+    """
+
+    lazy = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blocks (
+            height INTEGER PRIMARY KEY,
+            hash TEXT NOT NULL UNIQUE,
+            time REAL NOT NULL,
+            header TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            height INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            txid TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            receiver TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (height, position)
+        );
+        CREATE INDEX IF NOT EXISTS blocks_time ON blocks (time);
+        CREATE INDEX IF NOT EXISTS transactions_txid ON transactions (txid);
+        CREATE INDEX IF NOT EXISTS transactions_sender ON transactions (sender);
+        CREATE INDEX IF NOT EXISTS transactions_receiver ON transactions (receiver);
+        CREATE INDEX IF NOT EXISTS transactions_timestamp ON transactions (timestamp);
+    """
+
+    def __init__(self, path, legacy_file=None, synchronous="NORMAL"):
+        """
+        :param str path: Path of the database file
+        :param str legacy_file: blockchain.json file to migrate from if the database is empty
+        :param str synchronous: SQLite synchronous pragma (OFF, NORMAL or FULL)
+        """
+        self.path = path
+        self.legacy_file = legacy_file
+        self.synchronous = synchronous
+
+        self.connection = None
+        self.lock = RLock()
+        self.count = 0
+        self.chain = SqliteChain(self)
+
+    def __len__(self):
+        return self.count
+
+    def open(self):
+        with self.lock:
+            if self.connection:
+                return
+
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            self.connection.executescript(self.SCHEMA)
+
+            self.count = self.connection.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+
+            if not self.count:
+                self.migrate()
+
+    def hash_at(self, height):
+        with self.lock:
+            row = self.connection.execute("SELECT hash FROM blocks WHERE height = ?", (height,)).fetchone()
+
+        return row[0]
+
+    def read_range(self, start, stop):
+        with self.lock:
+            headers = self.connection.execute(
+                "SELECT header FROM blocks WHERE height >= ? AND height < ? ORDER BY height",
+                (start, stop)).fetchall()
+            transactions = self.connection.execute(
+                "SELECT height, data FROM transactions WHERE height >= ? AND height < ? ORDER BY height, position",
+                (start, stop)).fetchall()
+
+        blocks = []
+        for (header,) in headers:
+            block = json.loads(header)
+            block["transactions"] = []
+            blocks.append(block)
+
+        for height, data in transactions:
+            blocks[height - start]["transactions"].append(json.loads(data))
+
+        return blocks
+
+    def load(self):
+        self.open()
+        return self.chain
+
+    def append(self, block):
+        header = {key: value for key, value in block.items() if key != "transactions"}
+
+        with self.lock:
+            height = self.count
+            self.connection.execute(
+                "INSERT INTO blocks (height, hash, time, header) VALUES (?, ?, ?, ?)",
+                (height, block["hash"], block["time"], json.dumps(header)))
+
+            self.connection.executemany(
+                "INSERT INTO transactions (height, position, txid, sender, receiver, timestamp, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(height, position, transaction["id"], transaction["sender"], transaction["receiver"],
+                  transaction["timestamp"], json.dumps(transaction, default=plain))
+                 for position, transaction in enumerate(block["transactions"])])
+
+            self.count += 1
+
+    def truncate(self, height):
+        with self.lock:
+            self.connection.execute("DELETE FROM transactions WHERE height >= ?", (height,))
+            self.connection.execute("DELETE FROM blocks WHERE height >= ?", (height,))
+            self.count = height
+            self.chain.cache.clear()
+
+    def prune(self, start, stop):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT height, header FROM blocks WHERE height >= ? AND height < ?", (start, stop)).fetchall()
+            updates = []
+            for height, header in rows:
+                header = json.loads(header)
+                header["pruned"] = True
+                updates.append((json.dumps(header), height))
+
+            self.connection.executemany("UPDATE blocks SET header = ? WHERE height = ?", updates)
+            self.connection.execute("DELETE FROM transactions WHERE height >= ? AND height < ?", (start, stop))
+            self.connection.commit()
+            self.chain.cache.clear()
+
+        return stop
+
+    def flush(self, fsync=False):
+        with self.lock:
+            if self.connection:
+                self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            if self.connection:
+                self.connection.commit()
+                self.connection.close()
+                self.connection = None
+
+    def block_hashes(self, stop):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT hash FROM blocks WHERE height < ? ORDER BY height", (stop,)).fetchall()
+
+        return [block_hash for (block_hash,) in rows]
+
+    def address_transactions(self, public_key, offset=0, limit=None):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT data FROM transactions WHERE sender = ? OR receiver = ? "
+                "ORDER BY height, position LIMIT ? OFFSET ?",
+                (public_key, public_key, -1 if limit is None else limit, offset)).fetchall()
+
+        return [json.loads(data) for (data,) in rows]
+
+
+class MappedStore(BlockStore):
+    """
+    Keeps blocks in a single binary file that is memory mapped, with an offset
+    table next to it. Blocks are decoded from the mapping when accessed.
+    """
+
+    lazy = True
+
+    # offset, length, block time, block hash
+    INDEX_ENTRY = struct.Struct("<QId32s")
+
+    def __init__(self, path, legacy_file=None, fsync_every=1, fsync_interval=0):
+        """
+        :param str path: Path of the block file, the offset table is stored at path + ".idx"
+        :param str legacy_file: blockchain.json file to migrate from if the store is empty
+        :param int fsync_every: Fsync on commit once this many blocks are waiting (0 leaves it to the OS)
+        :param float fsync_interval: Also fsync on commit once the oldest waiting block is this many seconds old
+        """
+        self.path = path
+        self.legacy_file = legacy_file
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self.entries = []
+        self.unsynced = 0
+        self.opened = False
+        self.lock = RLock()
+
+        self.data_file = None
+        self.index_file = None
+        self.map = None
+        self.mapped_size = 0
+
+        self.chain = LazyChain(self)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def index_path(self):
+        return self.path + ".idx"
+
+    @property
+    def synced_path(self):
+        return self.path + ".synced"
+
+    @property
+    def data_size(self):
+        if not self.entries:
+            return 0
+
+        offset, length, _, _ = self.entries[-1]
+        return offset + length
+
+    def open(self):
+        with self.lock:
+            if self.opened:
+                return
+
+            open(self.path, "ab").close()
+            open(self.index_path, "ab").close()
+
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+
+            size = self.INDEX_ENTRY.size
+            file_size = os.path.getsize(self.path)
+            for start in range(0, len(data) - size + 1, size):
+                entry = self.INDEX_ENTRY.unpack_from(data, start)
+
+                # entries pointing past the end of the block file are from a torn write
+                if entry[0] + entry[1] > file_size:
+                    logger.error(f"Block file is truncated at block {len(self.entries)}, dropping the rest")
+                    break
+                self.entries.append(entry)
+
+            # blocks written after the last fsync are only kept if they still match their hash
+            torn = self.find_torn(min(self.read_synced(), len(self.entries)))
+            if torn is not None:
+                logger.error(f"Block file is truncated at block {torn}, dropping the rest")
+                self.entries = self.entries[:torn]
+
+            os.truncate(self.index_path, len(self.entries) * size)
+            os.truncate(self.path, self.data_size)
+            self.write_synced(len(self.entries), fsync=True)
+
+            self.data_file = open(self.path, "ab")
+            self.index_file = open(self.index_path, "ab")
+            self.opened = True
+            self.remap()
+
+            if not self.entries:
+                self.migrate()
+
+    def remap(self):
+        if self.map:
+            self.map.close()
+            self.map = None
+        self.mapped_size = 0
+
+        self.data_file.flush()
+        if self.data_size:
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapped_size = len(self.map)
+
+    def find_torn(self, synced):
+        if synced == len(self.entries):
+            return None
+
+        # only the records after the synced mark (the end of the file) are read, through a mapping
+        # rather than reading the whole store into memory
+        with open(self.path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            for height in range(synced, len(self.entries)):
+                offset, _, _, block_hash = self.entries[height]
+                try:
+                    if not record_intact(decode_binary(data, offset), block_hash.hex()):
+                        return height
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                    return height
+        finally:
+            data.close()
+
+        return None
+
+    def hash_at(self, height):
+        return self.entries[height][3].hex()
+
+    def read_range(self, start, stop):
+        with self.lock:
+            entries = self.entries[start:stop]
+            if entries and entries[-1][0] + entries[-1][1] > self.mapped_size:
+                self.remap()
+
+            return [decode_binary(self.map, offset, raw_hex=True) for offset, _, _, _ in entries]
+
+    def load(self):
+        self.open()
+        return self.chain
+
+    def append(self, block):
+        record = encode_binary(block)
+
+        with self.lock:
+            entry = (self.data_size, len(record), block["time"], bytes.fromhex(block["hash"]))
+            self.data_file.write(record)
+            self.index_file.write(self.INDEX_ENTRY.pack(*entry))
+            self.entries.append(entry)
+            self.appended()
+
+    def truncate(self, height):
+        with self.lock:
+            if self.map:
+                self.map.close()
+                self.map = None
+                self.mapped_size = 0
+            self.data_file.close()
+            self.index_file.close()
+
+            if self.read_synced() > height:
+                self.write_synced(height, fsync=True)
+
+            self.entries = self.entries[:height]
+            self.chain.cache.clear()
+            os.truncate(self.index_path, height * self.INDEX_ENTRY.size)
+            os.truncate(self.path, self.data_size)
+
+            self.data_file = open(self.path, "ab")
+            self.index_file = open(self.index_path, "ab")
+            self.remap()
+
+    def flush(self, fsync=False):
+        with self.lock:
+            # the block data has to reach the disk before the offsets pointing into it
+            for f in (self.data_file, self.index_file):
+                if f:
+                    f.flush()
+                    if fsync:
+                        os.fsync(f.fileno())
+
+            if fsync and self.opened:
+                self.write_synced(len(self.entries))
+                self.unsynced = 0
+
+    def close(self):
+        with self.lock:
+            if self.opened:
+                self.flush(fsync=True)
+                if self.map:
+                    self.map.close()
+                    self.map = None
+                self.data_file.close()
+                self.index_file.close()
+                self.opened = False
+
+
+def write_snapshot(path, snapshot):
+    # written to a temporary file first so a crash never leaves a half written snapshot
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(snapshot, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        try:
+            return json.load(f)
+        except json.decoder.JSONDecodeError:
+            return None
+
+
+def open_storage(file, config=None):
+    """
+    Opens the block store used for the given blockchain file. The backend is
+    picked from a URI prefix (sqlite://chain.db, mmap://chain.dat) or the
+    "backend" option.
+
+    :param str file: Path or URI of the blockchain, or None to keep the blockchain in memory only
+    :param dict config: Storage options from config.json
+    """
+    if file is None:
+        return None
+
+    config = config or {}
+    backend = config.get("backend", "segments")
+
+    legacy_file = file
+    if "://" in file:
+        backend, file = file.split("://", 1)
+        legacy_file = None
+
+    options = config.get(backend, {})
+
+    if backend == "segments":
+        path = os.path.splitext(file)[0] + ".blocks"
+        return SegmentStore(path, legacy_file=legacy_file, **options)
+    elif backend == "sqlite":
+        path = file if legacy_file is None else os.path.splitext(file)[0] + ".db"
+        return SqliteStore(path, legacy_file=legacy_file, **options)
+    elif backend == "mmap":
+        path = file if legacy_file is None else os.path.splitext(file)[0] + ".dat"
+        return MappedStore(path, legacy_file=legacy_file, **options)
+    else:
+        raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,192 @@
+import sys
+
+from .canonical import BLOCK_UNHASHED, TRANSACTION_UNHASHED, encode_canonical
+from .serialization import as_hex_bytes
+
+MISSING = object()
+
+
+class Record:
+    """
+    Compact read-only mapping over a block or transaction. Lowercase hex
+    strings (hashes, keys and signatures) are kept as raw bytes and only
+    turned back into strings when they are read. Since records never change,
+    their canonical encoding is cached the first time it is needed, so a
+    block is only encoded once while it is validated and added. The cache is
+    dropped once the block is on the chain, and pooled transactions are
+    plain dicts, so relaying and assembling blocks encode them again.
+    """
+
+    __slots__ = ("_extra", "_encoded")
+    FIELDS = ()
+    UNHASHED = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, cls):
+            return data
+
+        record = cls.__new__(cls)
+        for key in cls.FIELDS:
+            setattr(record, key, MISSING)
+        record._extra = None
+        record._encoded = None
+
+        for key, value in data.items():
+            value = record.pack(key, value)
+            if key in cls.FIELDS:
+                setattr(record, key, value)
+            else:
+                # unknown keys still have to round trip, they are part of the hash
+                if record._extra is None:
+                    record._extra = {}
+                record._extra[key] = value
+
+        return record
+
+    def pack(self, key, value):
+        if isinstance(value, str):
+            raw = as_hex_bytes(value)
+            return raw if raw is not None else sys.intern(value)
+
+        return value
+
+    def unpack(self, value):
+        if isinstance(value, bytes):
+            return value.hex()
+
+        return value
+
+    def raw_items(self):
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not MISSING:
+                yield key, value
+
+        if self._extra:
+            yield from self._extra.items()
+
+    def items(self):
+        for key, value in self.raw_items():
+            yield key, self.unpack(value)
+
+    def keys(self):
+        for key, _ in self.raw_items():
+            yield key
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return sum(1 for _ in self.raw_items())
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+        elif self._extra and key in self._extra:
+            value = self._extra[key]
+        else:
+            value = MISSING
+
+        if value is MISSING:
+            raise KeyError(key)
+
+        return self.unpack(value)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def canonical_bytes(self, form):
+        """
+        Gets the canonical encoding of the fields covered by the hash, encoding it only once
+
+        :param str form: The canonical form (canonical.JSON or canonical.BINARY)
+        :return bytes data: The encoded record without its unhashed fields
+        """
+        if self._encoded is None or self._encoded[0] != form:
+            self._encoded = (form, encode_canonical(self, form, self.UNHASHED))
+
+        return self._encoded[1]
+
+    def drop_encoding(self):
+        self._encoded = None
+
+    def to_dict(self):
+        data = {}
+        for key, value in self.items():
+            if isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, Record) else item for item in value]
+            data[key] = value
+
+        return data
+
+    def copy(self):
+        return self.to_dict()
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+
+        return self.to_dict() == other
+
+    def __reduce__(self):
+        # MISSING is only meaningful inside this process, so records are pickled as dicts
+        return type(self).from_dict, (self.to_dict(),)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Transaction(Record):
+    __slots__ = ("type", "sender", "receiver", "amount", "timestamp", "id", "signature")
+    FIELDS = __slots__
+    UNHASHED = TRANSACTION_UNHASHED
+
+
+class Block(Record):
+    __slots__ = ("height", "time", "blockchain_id", "protocol_version", "transactions",
+                 "previous_hash", "target", "nonce", "hash")
+    FIELDS = __slots__
+    UNHASHED = BLOCK_UNHASHED
+
+    def pack(self, key, value):
+        if key == "transactions" and isinstance(value, list):
+            return [Transaction.from_dict(transaction) for transaction in value]
+
+        return Record.pack(self, key, value)
+
+    def drop_encoding(self):
+        self._encoded = None
+        if isinstance(self.transactions, list):
+            for transaction in self.transactions:
+                transaction.drop_encoding()
+
+
+def block_header(block):
+    """
+    Cuts a block down to what a pruned node keeps: every field except the
+    transactions, so the hash chain and the targets can still be followed
+
+    :param dict block: The full block
+    :return dict header: The pruned block, marked with "pruned": True
+    """
+    header = {key: value for key, value in block.items() if key != "transactions"}
+    header["transactions"] = []
+    header["pruned"] = True
+
+    return header
@@ -0,0 +1,188 @@
+from time import time, sleep
+from collections import deque
+from threading import Lock
+
+# outcomes of a block that was mined
+MINED = "mined"
+STALE = "stale"
+REJECTED = "rejected"
+
+
+class MiningStats:
+    """
+    Counters for the miner and the work server: how fast nonces are tried,
+    how long templates take to build and how long after a new chain tip
+    the next template is ready, and what happened to the blocks that were
+    found. Safe to update from several threads.
+    """
+
+    def __init__(self, window=10):
+        """
+        :param float window: Seconds of attempts the current hashrate is averaged over
+        """
+        self.window = window
+        self.lock = Lock()
+        self.started = time()
+
+        self.attempts = 0
+        self.samples = deque()
+
+        self.templates = 0
+        self.template_build_time = 0
+        self.last_template_build = None
+        self.template_created = None
+
+        self.tip_changed = None
+        self.tip_latencies = 0
+        self.tip_latency_total = 0
+        self.last_tip_latency = None
+
+        self.blocks = {MINED: 0, STALE: 0, REJECTED: 0}
+        self.sync_wait = 0
+
+        self.watching = set()
+
+    def watch(self, blockchain):
+        """
+        Starts timing how long it takes to build a template after each new chain tip
+
+        :param Blockchain blockchain: The blockchain that is mined on
+        """
+        if id(blockchain) in self.watching:
+            return
+
+        self.watching.add(id(blockchain))
+        blockchain.tip_events.subscribe(lambda tip: self.record_tip_change())
+
+    def record_tip_change(self):
+        with self.lock:
+            # only the first change counts when several blocks arrive before the next template
+            if self.tip_changed is None:
+                self.tip_changed = time()
+
+    def record_attempts(self, attempts):
+        """
+        :param int attempts: Number of nonces tried since the last call
+        """
+        now = time()
+        with self.lock:
+            self.attempts += attempts
+            self.samples.append((now, self.attempts))
+
+            while len(self.samples) > 2 and self.samples[1][0] < now - self.window:
+                self.samples.popleft()
+
+    def record_template(self, build_time):
+        """
+        :param float build_time: Seconds it took to build the template
+        """
+        now = time()
+        with self.lock:
+            self.templates += 1
+            self.template_build_time += build_time
+            self.last_template_build = build_time
+            self.template_created = now
+
+            if self.tip_changed is not None:
+                self.last_tip_latency = now - self.tip_changed
+                self.tip_latency_total += self.last_tip_latency
+                self.tip_latencies += 1
+                self.tip_changed = None
+
+    def record_block(self, outcome):
+        """
+        :param str outcome: MINED if the block was added to the chain, STALE if another
+                            block was added first, REJECTED if it was invalid
+        """
+        with self.lock:
+            self.blocks[outcome] += 1
+
+    def record_sync_wait(self, seconds):
+        with self.lock:
+            self.sync_wait += seconds
+
+    @property
+    def hashrate(self):
+        # attempts per second over the last window
+        with self.lock:
+            if len(self.samples) < 2 or self.samples[-1][0] < time() - self.window:
+                return 0
+
+            (first_time, first_attempts), (last_time, last_attempts) = self.samples[0], self.samples[-1]
+            if last_time <= first_time:
+                return 0
+
+            return (last_attempts - first_attempts) / (last_time - first_time)
+
+    def snapshot(self):
+        """
+        :return dict stats: The current stats, ready to be dumped as json
+        """
+        hashrate = self.hashrate
+        now = time()
+
+        with self.lock:
+            found = sum(self.blocks.values())
+            uptime = now - self.started
+
+            return {
+                "uptime": round(uptime, 1),
+                "hashrate": round(hashrate, 1),
+                "average_hashrate": round(self.attempts / uptime, 1) if uptime else 0,
+                "attempts": self.attempts,
+                "templates": self.templates,
+                "template_age": round(now - self.template_created, 2) if self.template_created else None,
+                "last_template_build": self.last_template_build,
+                "average_template_build": self.template_build_time / self.templates if self.templates else None,
+                "last_tip_latency": self.last_tip_latency,
+                "average_tip_latency": self.tip_latency_total / self.tip_latencies if self.tip_latencies else None,
+                "blocks": dict(self.blocks),
+                "stale_rate": round(self.blocks[STALE] / found, 3) if found else 0,
+                "sync_wait": round(self.sync_wait, 1)
+            }
+
+
+def milliseconds(seconds):
+    return "-" if seconds is None else f"{round(seconds * 1000, 1)}ms"
+
+
+def format_stats(stats):
+    """
+    :param dict stats: Stats from MiningStats.snapshot
+    :return str text: The stats as lines of text
+    """
+    blocks = stats["blocks"]
+    template_age = "-" if stats["template_age"] is None else f"{stats['template_age']}s"
+
+    return "\n".join([
+        f"Hashrate:        {round(stats['hashrate'])} H/s (average {round(stats['average_hashrate'])} H/s)",
+        f"Attempts:        {stats['attempts']}",
+        f"Templates:       {stats['templates']} (current one is {template_age} old)",
+        f"Template build:  {milliseconds(stats['last_template_build'])} "
+        f"(average {milliseconds(stats['average_template_build'])})",
+        f"Tip to template: {milliseconds(stats['last_tip_latency'])} "
+        f"(average {milliseconds(stats['average_tip_latency'])})",
+        f"Blocks:          {blocks[MINED]} mined, {blocks[STALE]} stale, {blocks[REJECTED]} rejected "
+        f"({round(stats['stale_rate'] * 100, 1)}% stale)",
+        f"Waited for sync: {stats['sync_wait']}s"
+    ])
+
+
+def live_view(get_stats, interval=1):
+    """
+    Redraws the stats in the terminal until interrupted
+
+    :param get_stats: Returns the stats to show, such as MiningStats.snapshot
+    :param float interval: Seconds between redraws
+    """
+    lines = 0
+    while True:
+        text = format_stats(get_stats())
+
+        # move the cursor back up over the previous stats and draw over them
+        if lines:
+            print(f"\033[{lines}F", end="")
+        print("\n".join(line + "\033[K" for line in text.split("\n")))
+
+        lines = text.count("\n") + 1
+        sleep(interval)
@@ -1,47 +1,231 @@
-import json
+import heapq
 from time import time
+from collections import OrderedDict
+from threading import RLock
 
 from hashlib import sha256
 from nacl.encoding import HexEncoder
-from nacl.exceptions import BadSignatureError
-from nacl.signing import SigningKey, VerifyKey
+from nacl.signing import SigningKey
+
+from .canonical import transaction_bytes
+from .structures import Transaction
+from .verification import SignatureVerifier
 
 
 class TransactionPool:
-    def __init__(self, blockchain):
-        self.pool = []
-        self.unconfirmed_pool = []
+    """
+    Transactions waiting to be mined. They are indexed by txid (in the order
+    they were added), and the amounts each address has pending are kept as
+    running totals, so admitting or confirming a transaction doesn't scan
+    the pool. Transactions arrive on the server and consensus threads
+    while the miner reads the pool, so changes are made under a lock.
+
+    The pool is capped by number of transactions and by size, and
+    transactions expire once their timestamp is too old. When the pool is
+    full the transaction with the oldest timestamp is evicted first (ties
+    go to the lowest txid), so every node evicts in the same order.
+
+    Transactions are pooled as Transaction records, so the canonical
+    encoding made for the txid and signature check is reused to size them.
+    """
+
+    # transactions stay in the unconfirmed pool until their block is this many blocks deep
+    UNCONFIRMED_DEPTH = 4
+
+    # transactions dated further ahead than this are refused, they would never expire
+    MAX_FUTURE_TIME = 60 * 60 * 2
+
+    def __init__(self, blockchain, max_transactions=10000, max_bytes=5000000, expiry=60 * 60 * 24, verifier=None):
+        """
+        :param int max_transactions: Most transactions kept in the pool, 0 for no limit
+        :param int max_bytes: Most bytes of transactions kept in the pool, 0 for no limit
+        :param float expiry: Seconds after its timestamp that a transaction is dropped, 0 to keep it until it's mined
+        :param SignatureVerifier verifier: Verifier shared with the blockchain, a new one if None
+        """
+        self.transactions = {}
+        self.unconfirmed = OrderedDict()
         self.blockchain = blockchain
+        self.verifier = verifier or SignatureVerifier()
+        self.lock = RLock()
+
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+
+        # (timestamp, txid) of every pooled transaction, oldest first. removed
+        # transactions are only skipped once they reach the top
+        self.eviction_order = []
+        self.sizes = {}
+        self.size = 0
+
+        # address -> (number of pooled transactions, total amount)
+        self.sent = {}
+        self.received = {}
 
     @property
-    def txids(self):
-        ids = []
-        for transaction in self.pool:
-            ids.append(transaction["id"])
+    def pool(self):
+        with self.lock:
+            return list(self.transactions.values())
 
-        return ids
+    @property
+    def unconfirmed_pool(self):
+        with self.lock:
+            return [transaction for height, transaction in self.unconfirmed.values()]
+
+    @property
+    def txids(self):
+        return self.transactions.keys()
 
     @property
     def unconfirmed_txids(self):
-        ids = []
-        for transaction in self.unconfirmed_pool:
-            ids.append(transaction["id"])
+        return self.unconfirmed.keys()
 
-        return ids
+    def __contains__(self, txid):
+        return txid in self.transactions or txid in self.unconfirmed
 
-    def add(self, transaction):
-        if not self.validate_transaction(transaction):
+    @staticmethod
+    def transaction_size(transaction):
+        # about the size of the transaction once it's encoded for a block or a peer. for
+        # records the canonical encoding is already cached from the signature check
+        return len(transaction_bytes(transaction)) + len(transaction["id"]) + len(transaction["signature"])
+
+    def valid_timestamp(self, transaction):
+        timestamp = transaction.get("timestamp")
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
             return False
 
-        if transaction["id"] in self.txids or transaction["id"] in self.unconfirmed_txids:
+        now = time()
+        if self.expiry and timestamp < now - self.expiry:
             return False
 
-        if not self.check_for_overspending(transaction):
+        return timestamp <= now + self.MAX_FUTURE_TIME
+
+    def add(self, transaction):
+        return self.add_many([transaction])[0]
+
+    def add_many(self, transactions):
+        """
+        Adds a batch of transactions, their signatures are checked together
+
+        :param list transactions: The transactions to add
+        :return list results: True for each transaction that was added
+        """
+        results = [False] * len(transactions)
+
+        self.expire()
+
+        # already pooled, already in a block or expired, checked before the signatures since they are cheap
+        candidates = [i for i, transaction in enumerate(transactions)
+                      if transaction["id"] not in self and transaction["id"] not in self.blockchain.txids
+                      and self.valid_timestamp(transaction)]
+
+        # records cache the encoding the check makes, admit sizes them from it
+        records = [Transaction.from_dict(transactions[i]) for i in candidates]
+        verified = self.verifier.verify(records)
+        for i, record, valid in zip(candidates, records, verified):
+            if valid:
+                results[i] = self.admit(record)
+
+        return results
+
+    def admit(self, transaction):
+        # the signature has already been checked
+        if not self.validate_transaction(transaction, check_signature=False):
             return False
 
-        self.pool.append(transaction)
+        with self.lock:
+            # checked again, another thread may have added it while the signature was checked
+            if transaction["id"] in self:
+                return False
+
+            if not self.check_for_overspending(transaction):
+                return False
+
+            size = self.transaction_size(transaction)
+            order = (transaction["timestamp"], transaction["id"])
+
+            # when the pool is full, a transaction that would be evicted first isn't added at all
+            if self.full(1, size):
+                oldest = self.oldest()
+                if oldest is None or order < oldest:
+                    return False
+
+            self.transactions[transaction["id"]] = transaction
+            self.sizes[transaction["id"]] = size
+            self.size += size
+            self.update_totals(transaction, 1)
+            heapq.heappush(self.eviction_order, order)
+
+            while self.full():
+                self.remove(heapq.heappop(self.eviction_order)[1])
+
+            self.compact()
+
         return True
 
+    def full(self, count=0, size=0):
+        """
+        :param int count: Number of transactions about to be added
+        :param int size: Bytes about to be added
+        :return bool result: True if the pool would be over one of its limits
+        """
+        return (self.max_transactions and len(self.transactions) + count > self.max_transactions) or \
+            (self.max_bytes and self.size + size > self.max_bytes)
+
+    def oldest(self):
+        # drops the entries of transactions that were already removed from the top
+        while self.eviction_order and self.eviction_order[0][1] not in self.transactions:
+            heapq.heappop(self.eviction_order)
+
+        return self.eviction_order[0] if self.eviction_order else None
+
+    def expire(self):
+        """
+        Removes the transactions that are older than the expiry time
+        """
+        if not self.expiry:
+            return
+
+        with self.lock:
+            cutoff = time() - self.expiry
+            while self.oldest() and self.oldest()[0] < cutoff:
+                self.remove(heapq.heappop(self.eviction_order)[1])
+
+    def compact(self):
+        # mined transactions leave their entries behind, rebuild once they outnumber the pooled ones
+        if len(self.eviction_order) > 2 * len(self.transactions) + 64:
+            self.eviction_order = [(transaction["timestamp"], txid) for txid, transaction in self.transactions.items()]
+            heapq.heapify(self.eviction_order)
+
+    def remove(self, txid):
+        """
+        Takes a transaction out of the pool
+
+        :param str txid: The id of the transaction
+        :return dict transaction: The removed transaction, None if it wasn't pooled
+        """
+        with self.lock:
+            transaction = self.transactions.pop(txid, None)
+            if transaction is not None:
+                self.size -= self.sizes.pop(txid)
+                self.update_totals(transaction, -1)
+
+        return transaction
+
+    def update_totals(self, transaction, direction):
+        """
+        :param dict transaction: Transaction that was added to (direction 1) or removed from (direction -1) the pool
+        """
+        for totals, address in ((self.sent, transaction["sender"]), (self.received, transaction["receiver"])):
+            count, amount = totals.get(address, (0, 0.0))
+            count += direction
+
+            # dropped once the address has nothing pending, so rounding errors don't pile up
+            if count:
+                totals[address] = (count, amount + direction * transaction["amount"])
+            else:
+                totals.pop(address, None)
+
     def create_transaction(self, private_key, public_key, receiver, amount):
         transaction = {
             "type": "payment",
@@ -51,12 +235,12 @@ class TransactionPool:
             "timestamp": time(),
         }
 
-        transaction_bytes = json.dumps(transaction, sort_keys=True).encode("ascii")
-        transaction["id"] = sha256(transaction_bytes).hexdigest()
+        encoded = transaction_bytes(transaction)
+        transaction["id"] = sha256(encoded).hexdigest()
 
         signing_key = SigningKey(private_key, encoder=HexEncoder)
 
-        signature = signing_key.sign(transaction_bytes).signature
+        signature = signing_key.sign(encoded).signature
         transaction["signature"] = HexEncoder.encode(signature).decode("ascii")
 
         return transaction
@@ -71,33 +255,16 @@ class TransactionPool:
             "timestamp": time(),
         }
 
-        transaction_bytes = json.dumps(transaction, sort_keys=True).encode("ascii")
-        transaction["id"] = sha256(transaction_bytes).hexdigest()
+        transaction["id"] = sha256(transaction_bytes(transaction)).hexdigest()
 
         return transaction
 
-    def validate_transaction(self, full_transaction):
+    def validate_transaction(self, full_transaction, check_signature=True):
 
         if full_transaction["amount"] > self.blockchain.get_balance(full_transaction["sender"]):
             return False
 
-        transaction = full_transaction.copy()
-        public_key = transaction["sender"]
-        txid = transaction.pop("id")
-        signature = transaction.pop("signature")
-
-        # verify signature
-        signature = HexEncoder.decode(signature)
-        transaction = json.dumps(transaction, sort_keys=True).encode("ascii")
-        verify_key = VerifyKey(public_key, encoder=HexEncoder)
-
-        # verify txid
-        if sha256(transaction).hexdigest() != txid:
-            return False
-
-        try:
-            verify_key.verify(transaction, signature)
-        except BadSignatureError:
+        if check_signature and not self.verifier.verify([full_transaction])[0]:
             return False
 
         return True
@@ -109,15 +276,7 @@ class TransactionPool:
         :param str public_key: The public key of the wallet to check the balance of
         :return float balance: The counted balance of the wallet
         """
-        balance = 0.0
-
-        for transaction in self.pool:
-            if transaction["sender"] == public_key:
-                balance -= transaction["amount"]
-            if transaction["receiver"] == public_key:
-                balance += transaction["amount"]
-
-        return balance
+        return self.received.get(public_key, (0, 0.0))[1] - self.sent.get(public_key, (0, 0.0))[1]
 
     def check_for_overspending(self, transaction):
         """
@@ -136,23 +295,55 @@ class TransactionPool:
         else:
             return True
 
-    def get_pending_transactions(self, transaction_inv):
+    def get_pending_transactions(self, confirmed_txids):
+        """
+        Gets the pooled transactions that are not in a block yet
+
+        :param set confirmed_txids: Ids of the transactions in the blockchain
+        :return list transactions: The transactions to put in the next block, in the order they were added
+        """
+        self.expire()
+
         pending_transactions = []
-        for transaction in self.pool:
-            if not transaction["id"] in transaction_inv:
+
+        # a transaction can depend on pooled funds that were evicted or expired, those are left out
+        # so the block stays valid. balances change in the same order the block applies them
+        balances = {}
+        with self.lock:
+            for txid, transaction in self.transactions.items():
+                if txid in confirmed_txids:
+                    continue
+
+                sender, receiver, amount = transaction["sender"], transaction["receiver"], transaction["amount"]
+                for address in (sender, receiver):
+                    if address not in balances:
+                        balances[address] = self.blockchain.get_balance(address)
+
+                if amount > self.blockchain.get_balance(sender) or balances[sender] - amount < 0:
+                    continue
+
+                balances[sender] -= amount
+                balances[receiver] += amount
                 pending_transactions.append(transaction)
 
         return pending_transactions
 
     def update_pool(self, blockchain):
-        for transaction in blockchain[-1]["transactions"]:
-            if transaction in self.pool:
-                self.pool.remove(transaction)
-                self.unconfirmed_pool.append(transaction)
+        block = blockchain[-1]
 
-        if len(blockchain) < 5:
-            return True
+        with self.lock:
+            for transaction in block["transactions"]:
+                if self.remove(transaction["id"]) is not None:
+                    self.unconfirmed[transaction["id"]] = (block["height"], transaction)
+
+            # confirmations are added in block order, so the oldest ones are at the front
+            while self.unconfirmed:
+                height, transaction = next(iter(self.unconfirmed.values()))
+                if block["height"] - height < self.UNCONFIRMED_DEPTH:
+                    break
+
+                self.unconfirmed.popitem(last=False)
+
+            self.compact()
 
-        for transaction in self.unconfirmed_pool:
-            if transaction in blockchain[-5]["transactions"]:
-                self.unconfirmed_pool.remove(transaction)
+        self.expire()
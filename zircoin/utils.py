@@ -1,7 +1,6 @@
 import urllib.request
-import hashlib
-import time
 from .logger import Logger
+from .benchmark import make_template, measure_hashrate
 
 logger = Logger("utils")
 
@@ -14,18 +13,6 @@ def get_public_ip():
         logger.error("Could not get public ip from ident.me", fatal=True)
 
 
-def test_hashrate():
-    timeout = time.time() + 5
-
-    nonce = 0
-    hashes = 0
-
-    while True:
-        if time.time() >= timeout:
-            break
-
-        nonce += 1
-        hashlib.sha256(str(nonce).encode()).hexdigest()
-        hashes += 1
-
-    return hashes/5
+def test_hashrate(workers=1, duration=5, executor=None):
+    # hashes an empty block template the same way the miner does
+    return measure_hashrate(make_template(0), workers, duration, executor)
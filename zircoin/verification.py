@@ -0,0 +1,320 @@
+import os
+import multiprocessing
+from threading import Lock
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from hashlib import sha256
+from nacl.encoding import HexEncoder
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+
+from .canonical import block_bytes, canonical_form, transaction_bytes
+
+
+@lru_cache(maxsize=4096)
+def get_verify_key(public_key):
+    # most transactions come from a few wallets, so their keys are only decoded once
+    return VerifyKey(public_key, encoder=HexEncoder)
+
+
+def verify_transaction(full_transaction, signature_verified=False, protocol_version=None):
+    """
+    Checks the txid and signature of a transaction. These checks don't depend
+    on the chain, so they can run anywhere (including worker processes).
+
+    :param dict full_transaction: The signed transaction
+    :param bool signature_verified: Only check the txid, the signature is known to be valid for it
+    :param str protocol_version: Protocol version of the block the transaction is in, None for this node's version
+    :return bool result: True if the txid and signature are valid
+    """
+    public_key = full_transaction["sender"]
+    txid = full_transaction["id"]
+
+    # verify signature
+    signature = HexEncoder.decode(full_transaction["signature"])
+    transaction = transaction_bytes(full_transaction, canonical_form(protocol_version))
+    verify_key = get_verify_key(public_key)
+
+    # verify txid
+    if sha256(transaction).hexdigest() != txid:
+        return False
+
+    if signature_verified:
+        return True
+
+    try:
+        verify_key.verify(transaction, signature)
+    except BadSignatureError:
+        return False
+
+    return True
+
+
+def check_transactions(transactions, signature_verified=False, protocol_version=None):
+    """
+    Runs verify_transaction on every transaction
+
+    :param list transactions: The signed transactions
+    :param bool signature_verified: Only check the txids
+    :param str protocol_version: Protocol version the transactions are encoded in
+    :return list results: True for each transaction with a valid txid and signature
+    """
+    results = []
+    for transaction in transactions:
+        try:
+            results.append(verify_transaction(transaction, signature_verified, protocol_version))
+        except Exception:
+            # malformed transactions are just invalid
+            results.append(False)
+
+    return results
+
+
+def check_block(block):
+    """
+    Runs the checks on a block that don't depend on the rest of the chain:
+    the block hash, and the txid and signature of every payment.
+
+    :param dict block: The block to check
+    :return str error: Why the block is invalid, or None if it passed
+    """
+    # the genesis block is not hashed or signed by anyone
+    if block["height"] == 0:
+        return None
+
+    try:
+        if sha256(block_bytes(block)).hexdigest() != block["hash"]:
+            return "Hash is invalid"
+
+        for transaction in block["transactions"][1:]:
+            if not verify_transaction(transaction, protocol_version=block["protocol_version"]):
+                return "Invalid transactions detected"
+    except Exception as e:
+        return f"Malformed block ({type(e).__name__})"
+
+    return None
+
+
+def check_blocks(start, blocks):
+    for i, block in enumerate(blocks):
+        error = check_block(block)
+        if error:
+            return start + i, error
+
+    return None
+
+
+# worker processes a ChainVerifier starts unless told otherwise, a few are enough to keep up with a sync
+DEFAULT_WORKERS = 4
+
+shared = None
+shared_lock = Lock()
+
+
+def pool_context():
+    # forking is the only start method that doesn't re-run the main script in every worker
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+
+    return None
+
+
+class SignatureVerifier:
+    """
+    Checks the txids and signatures of batches of transactions, for
+    admitting transactions to the pool and for validating blocks. Large
+    batches are split across a pool of threads: libsodium releases the
+    GIL while it verifies, and the transactions don't have to be copied
+    to other processes.
+
+    The (txid, signature) pairs that passed are remembered, so the
+    signature of a pooled transaction isn't checked again when the block
+    that confirms it is validated.
+    """
+
+    def __init__(self, workers=None, min_batch=32, cache_size=50000):
+        """
+        :param int workers: Number of threads, None or 0 for one per core
+        :param int min_batch: Smaller batches are checked on the calling thread
+        :param int cache_size: Number of verified signatures to remember, the least recently used are forgotten
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.min_batch = min_batch
+        self.executor = None
+        # the verifier is shared by the server, consensus and miner threads
+        self.executor_lock = Lock()
+
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = Lock()
+
+    @staticmethod
+    def cache_key(transaction):
+        try:
+            key = transaction["id"], transaction["signature"]
+        except (KeyError, TypeError, IndexError):
+            return None
+
+        # malformed transactions are never remembered
+        return key if all(isinstance(part, str) for part in key) else None
+
+    def verify(self, transactions, protocol_version=None):
+        """
+        Checks a batch of transactions
+
+        :param list transactions: The signed transactions
+        :param str protocol_version: Protocol version of the block they are in, None for pooled transactions
+        :return list results: True or False for each transaction, in the same order
+        """
+        transactions = list(transactions)
+        keys = [self.cache_key(transaction) for transaction in transactions]
+
+        with self.cache_lock:
+            cached = []
+            for key in keys:
+                if key is not None and key in self.cache:
+                    self.cache.move_to_end(key)
+                    cached.append(True)
+                else:
+                    cached.append(False)
+
+        # a remembered signature is only valid for the txid it signed, so the txid is still checked
+        results = [None] * len(transactions)
+        known = [i for i in range(len(transactions)) if cached[i]]
+        known_transactions = [transactions[i] for i in known]
+        for i, valid in zip(known, check_transactions(known_transactions, True, protocol_version)):
+            results[i] = valid
+
+        unknown = [i for i in range(len(transactions)) if not cached[i]]
+        for i, valid in zip(unknown, self.check([transactions[i] for i in unknown], protocol_version)):
+            results[i] = valid
+
+        with self.cache_lock:
+            for i in unknown:
+                if results[i]:
+                    self.remember(keys[i])
+
+        return results
+
+    def remember(self, key):
+        self.cache[key] = True
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def check(self, transactions, protocol_version=None):
+        if self.workers <= 1 or len(transactions) < self.min_batch:
+            return check_transactions(transactions, False, protocol_version)
+
+        # started on first use, most blockchains (such as the ones replayed while verifying) never need it
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="verifier")
+            executor = self.executor
+
+        size = -(-len(transactions) // self.workers)
+        chunks = [transactions[start:start + size] for start in range(0, len(transactions), size)]
+
+        results = executor.map(check_transactions, chunks, [False] * len(chunks), [protocol_version] * len(chunks))
+        return [result for chunk_results in results for result in chunk_results]
+
+    def close(self):
+        with self.executor_lock:
+            executor, self.executor = self.executor, None
+
+        if executor:
+            executor.shutdown()
+
+
+class ChainVerifier:
+    """
+    Splits the stateless block checks across a pool of worker processes.
+    The checks that need the chain (linkage, heights, balances, targets)
+    are left to Blockchain.add with prechecked=True.
+
+    The workers are forked when the verifier is created, so a node gets
+    one from shared_verifier on the main thread before its server, consensus
+    and miner threads start (a thread holding a lock while another one forks
+    can deadlock the children) and hands it to Blockchain.load and Consensus.
+    """
+
+    def __init__(self, workers=None, chunk_size=64):
+        """
+        :param int workers: Number of worker processes, None or 0 for DEFAULT_WORKERS (at most one per core),
+                            1 checks the blocks on the calling thread
+        :param int chunk_size: Number of blocks sent to a worker at a time
+        """
+        self.workers = workers or min(DEFAULT_WORKERS, os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.executor = None
+
+        if self.workers > 1 and pool_context():
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context())
+            # a fork pool starts all of its workers on the first submit, do that now instead of on first use
+            self.executor.submit(os.getpid).result()
+
+    def verify(self, blocks, progress=None):
+        """
+        Checks every block
+
+        :param list blocks: The blocks to check, any sequence that supports slicing
+        :param progress: Called with (checked, total) as chunks complete
+        :return tuple failure: (index, error) of the first invalid block, or None if all passed
+        """
+        total = len(blocks)
+        chunks = range(0, total, self.chunk_size)
+
+        if not self.executor:
+            for start in chunks:
+                failure = check_blocks(start, blocks[start:start + self.chunk_size])
+                if failure:
+                    return failure
+                if progress:
+                    progress(min(start + self.chunk_size, total), total)
+            return None
+
+        # only keep a few chunks per worker in flight, so lazy chains aren't read into memory at once
+        pending = deque()
+        checked = 0
+        failure = None
+        for start in chunks:
+            pending.append(self.executor.submit(check_blocks, start, blocks[start:start + self.chunk_size]))
+
+            while len(pending) >= self.workers * 4 or (start + self.chunk_size >= total and pending):
+                failure = pending.popleft().result()
+                if failure:
+                    break
+
+                checked = min(checked + self.chunk_size, total)
+                if progress:
+                    progress(checked, total)
+
+            if failure:
+                break
+
+        for future in pending:
+            future.cancel()
+
+        return failure
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+def shared_verifier(workers=1):
+    """
+    Gets the ChainVerifier shared by everything in this process, creating it on the first call.
+    Its workers are forked then, so the first call belongs on the main thread before other threads start.
+
+    :param int workers: Number of worker processes if the verifier is created, see ChainVerifier
+    :return ChainVerifier verifier: The shared verifier
+    """
+    global shared
+
+    with shared_lock:
+        if shared is None:
+            shared = ChainVerifier(workers)
+
+        return shared
@@ -0,0 +1,305 @@
+import os
+import asyncio
+import secrets
+import requests
+from types import SimpleNamespace
+from collections import OrderedDict
+from time import time, sleep
+from random import getrandbits
+from hashlib import sha256
+from threading import Thread
+from multiprocessing import Process
+from aiohttp import web
+
+from .canonical import block_bytes, nonce_layout
+from .logger import Logger
+from .messages import broadcast_block
+from .miner import block_outcome
+from .mining import search_layout
+from .structures import Block
+from .telemetry import MiningStats, MINED, STALE, REJECTED
+
+logger = Logger("workserver")
+
+
+class Job:
+    def __init__(self, job_id, tip, template):
+        self.job_id = job_id
+        self.tip = tip
+        self.template = template
+        self.created = time()
+        self.next_nonce = getrandbits(64)
+        self.form, self.prefix, self.suffix = nonce_layout(template)
+
+        # nonces already submitted for this job, so resubmissions aren't counted twice
+        self.solutions = set()
+
+
+class WorkServer:
+    """
+    Hands out block templates and nonce ranges to pool workers, and turns
+    their solutions into blocks. The workers only hash, the node keeps the
+    chain and the transaction pool for all of them.
+    """
+
+    # older jobs are remembered so late solutions can be told apart from bad ones
+    MAX_JOBS = 16
+
+    def __init__(self, blockchain, connection_pool, config, payout_address, host="0.0.0.0", port=2228,
+                 range_size=500000, template_lifetime=10, stats=None):
+        """
+        :param str payout_address: Wallet the block rewards are paid to
+        :param str host: Address the work server listens on
+        :param int port: Port the work server listens on
+        :param int range_size: Number of nonces handed to a worker at a time
+        :param float template_lifetime: Seconds before the template is rebuilt to pick up new transactions
+        :param MiningStats stats: Records the attempts of the workers, template builds and found blocks
+        """
+        self.blockchain = blockchain
+        self.connection_pool = connection_pool
+        self.config = config
+        self.payout_address = payout_address
+        self.host = host
+        self.port = port
+        self.range_size = range_size
+        self.template_lifetime = template_lifetime
+        self.stats = stats or MiningStats()
+        self.stats.watch(blockchain)
+
+        self.job = None
+        self.jobs = OrderedDict()
+        self.job_count = 0
+        # job ids start with a random session id, so solutions for the jobs of an
+        # earlier run of the server can never match the jobs of this one
+        self.session = secrets.token_hex(8)
+
+        # make_block only needs the public key of the wallet it pays
+        self.wallet = SimpleNamespace(public_key=payout_address)
+
+    def current_job(self):
+        tip = self.blockchain.previous_hash
+        if self.job and self.job.tip == tip and time() - self.job.created < self.template_lifetime:
+            return self.job
+
+        build_started = time()
+        if self.blockchain.calculate_target():
+            logger.info("New mining target: " + str(self.blockchain.target))
+
+        template = self.blockchain.make_block(self.wallet)
+        template.pop("hash")
+
+        self.job_count += 1
+        self.job = Job(f"{self.session}-{self.job_count:x}", tip, template)
+        self.stats.record_template(time() - build_started)
+
+        self.jobs[self.job.job_id] = self.job
+        if len(self.jobs) > self.MAX_JOBS:
+            self.jobs.popitem(last=False)
+        return self.job
+
+    def get_work(self, job_id=None, attempts=0):
+        """
+        Gets the next nonce range to search. The template is only included
+        when the worker doesn't have the current job yet.
+
+        :param str job_id: The job the worker is working on
+        :param int attempts: Number of nonces the worker tried since it last asked for work
+        :return dict work: The job and the nonce range
+        """
+        if attempts > 0:
+            self.stats.record_attempts(attempts)
+
+        job = self.current_job()
+
+        work = {
+            "job_id": job.job_id,
+            "height": job.template["height"],
+            "target": job.template["target"],
+            "nonce_start": job.next_nonce,
+            "nonce_count": self.range_size
+        }
+        job.next_nonce += self.range_size
+
+        if job_id != job.job_id:
+            work["form"] = job.form
+            work["prefix"] = job.prefix.hex()
+            work["suffix"] = job.suffix.hex()
+
+        return work
+
+    def submit(self, job_id, nonce):
+        """
+        Builds the block for a solution and adds or broadcasts it
+
+        :param str job_id: The job the nonce was found for
+        :param str nonce: The nonce, as hex
+        :return tuple result: (accepted, reason)
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False, "unknown job"
+
+        if not isinstance(nonce, str) or not nonce or any(c not in "0123456789abcdef" for c in nonce):
+            return False, "invalid nonce"
+
+        if nonce in job.solutions:
+            return False, "duplicate"
+
+        block = dict(job.template)
+        block["nonce"] = nonce
+        block["hash"] = sha256(block_bytes(block)).hexdigest()
+        block = Block.from_dict(block)
+
+        # not a block at all, so it isn't counted as one
+        if not self.blockchain.valid_pow(block):
+            return False, "proof of work is invalid"
+
+        job.solutions.add(nonce)
+
+        # a real solution, but another block was added to the chain first
+        if job.tip != self.blockchain.previous_hash:
+            self.stats.record_block(STALE)
+            return False, "stale"
+
+        if self.config["fullnode"]:
+            if not self.blockchain.add(block, verbose=True):
+                self.stats.record_block(REJECTED)
+                return False, "block was rejected"
+
+            self.stats.record_block(MINED)
+            logger.info(f"✓ Pool mined block #{block['height']} ({block['hash']})")
+        else:
+            # peers would refuse an invalid block anyway, so don't send it to them
+            if not self.blockchain.validate(block, verbose=True):
+                self.stats.record_block(REJECTED)
+                return False, "block was rejected"
+
+            broadcast_block(block, self.connection_pool, self.blockchain)
+            Thread(target=self.record_outcome, args=(block,), daemon=True).start()
+
+        return True, block["hash"]
+
+    def record_outcome(self, block):
+        # a broadcast block only counts as mined once it is in the chain
+        outcome = block_outcome(self.blockchain, block)
+        self.stats.record_block(outcome)
+
+        if outcome == MINED:
+            logger.info(f"✓ Pool mined block #{block['height']} ({block['hash']})")
+        else:
+            logger.info(f"✗ Pool block #{block['height']} not accepted ({outcome})")
+
+    # AIOHTTP Routes
+
+    def work_route(self, request):
+        try:
+            attempts = int(request.query.get("attempts", 0))
+        except ValueError:
+            attempts = 0
+
+        return web.json_response(self.get_work(request.query.get("job"), attempts))
+
+    def stats_route(self, request):
+        return web.json_response(self.stats.snapshot())
+
+    async def submit_route(self, request):
+        try:
+            solution = await request.json()
+            accepted, reason = self.submit(solution["job_id"], solution["nonce"])
+        except (ValueError, KeyError, TypeError):
+            return web.json_response({"accepted": False, "reason": "invalid solution"}, status=400)
+
+        return web.json_response({"accepted": accepted, "reason": reason})
+
+    def aiohttp_server(self):
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get('/work', self.work_route),
+            web.post('/work/submit', self.submit_route),
+            web.get('/work/stats', self.stats_route)
+        ])
+
+        return web.AppRunner(self.app)
+
+    def start_server(self, runner):
+        logger.info(f"Starting work server on port {self.port}...")
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, host=self.host, port=self.port)
+        loop.run_until_complete(site.start())
+        loop.run_forever()
+
+
+def pool_worker(url):
+    """
+    Hashes nonce ranges from a work server until interrupted. Only needs
+    the work server, not a blockchain or any peers.
+
+    :param str url: Address of the work server, such as http://192.168.1.2:2228
+    """
+    session = requests.Session()
+    job = None
+    attempts = 0
+
+    while True:
+        try:
+            params = {"job": job["job_id"], "attempts": attempts} if job else {}
+            work = session.get(url + "/work", params=params, timeout=10).json()
+            attempts = 0
+        except (requests.exceptions.RequestException, ValueError):
+            logger.error(f"Could not get work from {url}, retrying")
+            sleep(2)
+            continue
+
+        # the template is only sent when the job changes
+        if "prefix" in work:
+            job = {
+                "job_id": work["job_id"],
+                "form": work["form"],
+                "prefix": bytes.fromhex(work["prefix"]),
+                "suffix": bytes.fromhex(work["suffix"])
+            }
+
+        # the attempts are reported to the work server with the next request for work
+        started = time()
+        result, attempts = search_layout(job["form"], job["prefix"], job["suffix"], work["target"],
+                                         work["nonce_start"], work["nonce_count"])
+        hashrate = attempts / max(time() - started, 1e-9)
+
+        if not result:
+            continue
+
+        try:
+            response = session.post(url + "/work/submit", json={"job_id": work["job_id"], "nonce": result[0]},
+                                    timeout=10).json()
+        except (requests.exceptions.RequestException, ValueError):
+            logger.error(f"Could not submit block #{work['height']} to {url}")
+            continue
+
+        if response.get("accepted"):
+            logger.info(f"✓ Found block #{work['height']} ({result[1]}) at {round(hashrate)} H/s")
+        else:
+            logger.info(f"✗ Block #{work['height']} not accepted: {response.get('reason')}")
+
+
+def run_pool_workers(url, workers=None):
+    """
+    Starts pool workers in separate processes and waits for them
+
+    :param str url: Address of the work server
+    :param int workers: Number of worker processes, None or 0 for one per core
+    """
+    workers = workers or os.cpu_count() or 1
+    logger.info(f"⛏  Mining for {url} with {workers} worker(s)...")
+
+    processes = [Process(target=pool_worker, args=(url,), daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
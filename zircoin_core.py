@@ -1,13 +1,18 @@
 from zircoin.wallet import Wallet
 from zircoin.miner import Miner
+from zircoin.mining import MiningPool
 from zircoin.logger import Logger
 from zircoin.server import Server
 from zircoin.consensus import Consensus
 from zircoin.networking import HttpRoutes
+from zircoin.workserver import WorkServer
 from zircoin.connections import ConnectionPool
 from zircoin.blockchain import Blockchain
 from zircoin.version import PROTOCOL_VERSION, NETWORKING_VERSION
 from zircoin.utils import test_hashrate
+from zircoin.benchmark import expected_block_time
+from zircoin.telemetry import MiningStats, live_view
+from zircoin.verification import shared_verifier
 from zircoin.messages import broadcast_transaction
 from zircoin.plotting import (
     wealth_distribution,
@@ -18,6 +23,7 @@ from zircoin.plotting import (
     block_time
 )
 
+import os
 import heapq
 import string
 import argparse
@@ -37,7 +43,16 @@ parser.add_argument("--port", "-p", type=int, help="Port for server to run on")
 parser.add_argument("--fullnode", "-f", default=False, action="store_true",
                     help="Eneble fullnode mode (must be port forwarded)")
 parser.add_argument("--wallet", "-w", type=str, help="Path to wallet file")
-parser.add_argument("--blockchain", "-b", type=str, help="Path to blockchain json file")
+parser.add_argument("--blockchain", "-b", type=str,
+                    help="Path to blockchain json file, or a storage URI such as sqlite://blockchain.db or mmap://blockchain.dat")
+parser.add_argument("--verify", default=False, action="store_true",
+                    help="Fully verify the stored blockchain on startup")
+parser.add_argument("--workers", type=int,
+                    help="Number of mining processes, 0 for one per core")
+parser.add_argument("--work-server", default=False, action="store_true",
+                    help="Hand out mining work to pool workers (simple_miner.py --pool)")
+parser.add_argument("--prune", type=int,
+                    help="Only keep the transactions of the last N blocks, 0 keeps every block")
 args = parser.parse_args()
 
 # application config
@@ -66,11 +81,25 @@ NODE_ID = hashlib.sha256(str(random.getrandbits(256)).encode()).hexdigest()
 
 # init blockchain
 
+# the verification workers are forked before any other thread starts, and only if they are used
+verification_config = config.get("verification", {})
+verify_on_load = args.verify or verification_config.get("verify_on_load", False)
+chain_verifier = shared_verifier(verification_config.get("workers") if verify_on_load else 1)
+
+# so are the mining workers, the miner only runs once the other threads are up
+mining_pool = MiningPool(args.workers if args.workers is not None else config.get("mining", {}).get("workers", 1))
+
+storage_config = dict(config.get("storage", {}))
+if args.prune is not None:
+    storage_config["prune"] = args.prune
+
 if args.blockchain:
-    blockchain = Blockchain(config["blockchain_id"], file=args.blockchain)
+    blockchain = Blockchain(config["blockchain_id"], file=args.blockchain, storage_config=storage_config,
+                            mempool_config=config.get("mempool"))
 else:
-    blockchain = Blockchain(config["blockchain_id"])
-blockchain.load()
+    blockchain = Blockchain(config["blockchain_id"], storage_config=storage_config,
+                            mempool_config=config.get("mempool"))
+blockchain.load(verify=verify_on_load, verifier=chain_verifier)
 
 # init modules
 
@@ -82,14 +111,19 @@ else:
 connection_pool = ConnectionPool(
     config, NODE_ID, server_config["port"])
 
+mining_stats = MiningStats()
+
 http_routes = HttpRoutes(blockchain, connection_pool,
-                    server_config, config, NODE_ID)
+                    server_config, config, NODE_ID, mining_stats=mining_stats)
 
 server = Server(blockchain, http_routes, server_config)
 
-consensus = Consensus(blockchain, connection_pool)
+consensus = Consensus(blockchain, connection_pool, verifier=chain_verifier)
 
-miner = Miner(blockchain, config, consensus, connection_pool)
+miner = Miner(blockchain, config, consensus, connection_pool, stats=mining_stats, pool=mining_pool)
+
+work_server = WorkServer(blockchain, connection_pool, config, wallet.public_key, stats=mining_stats,
+                         **config.get("work_server", {}))
 
 logger = Logger("zircoin")
 
@@ -97,8 +131,24 @@ logger = Logger("zircoin")
 def menu():
     run = True
 
+    mining_threads = []
+
     def mine():
-        miner.mine(wallet)
+        # the miner runs in the background, so the menu (and the stats view) stay usable while it mines
+        if mining_threads:
+            print("Stopping the miner...")
+            miner.stop()
+            mining_threads.pop().join()
+            print("Stopped mining.")
+            return
+
+        mining_thread = Thread(target=miner.mine, args=(wallet,), kwargs={"workers": args.workers}, name="miner")
+        mining_thread.daemon = True
+        mining_thread.start()
+        mining_threads.append(mining_thread)
+
+        print("Mining in the background, choose Mine again to stop.\n")
+        mining_stats_view()
 
     def wallet_info():
         print(f"Wallet address: {wallet.public_key}")
@@ -112,13 +162,8 @@ def menu():
 
     def zircoin_stats():
         # richlist
-        wallets = {}
-        for block in blockchain.chain:
-            for transaction in block["transactions"]:
-                wallets[transaction["receiver"]] = 0
-
-        for wallet in wallets:
-            wallets[wallet] = blockchain.get_balance(wallet)
+        wallets = {address: balance for address, balance in blockchain.ledger.balances.items()
+                   if address != "coinbase"}
 
         richest_wallets = heapq.nlargest(10, wallets, key=wallets.get)
 
@@ -143,12 +188,7 @@ def menu():
 
         # circulating supply
 
-        supply = 0
-
-        for wallet, balance in wallets.items():
-            supply += balance
-
-        print("\nCoins in circulation: " + str(supply))
+        print("\nCoins in circulation: " + str(blockchain.state.supply))
 
         # average block time
 
@@ -212,12 +252,7 @@ def menu():
             logger.info("Transaction invalid.")
 
     def transaction_history():
-        transactions = []
-
-        for block in blockchain.chain:
-            for transaction in block["transactions"]:
-                if transaction["sender"] == wallet.public_key or transaction["receiver"] == wallet.public_key:
-                    transactions.append(transaction)
+        transactions = blockchain.get_transaction_history(wallet.public_key)
 
         print("\nTransaction History\n")
         for transaction in transactions:
@@ -274,9 +309,29 @@ def menu():
             print("Up to date\n")
 
     def hashrate():
+        if mining_threads:
+            print("Stop mining first, the test uses the mining workers.")
+            return
+
         print("Testing...")
-        megahashes = test_hashrate() / 1000000
-        print(f"Your hashrate: {round(megahashes, 2)} MH/s")
+        # the server and consensus threads are running, so the test can't fork processes of its own
+        hashes = test_hashrate(mining_pool.workers, executor=mining_pool.executor)
+        print(f"Your hashrate: {round(hashes / 1000000, 2)} MH/s")
+
+        seconds = expected_block_time(hashes, blockchain.target)
+        if seconds:
+            print(f"Expected time to mine a block: {round(seconds)}s")
+
+    def mining_stats_view():
+        print("Mining stats (ctrl+c to go back)\n")
+
+        # the miner's log would scroll the view away, it's quiet while the view is open
+        verbose = miner.verbose
+        miner.verbose = False
+        try:
+            live_view(mining_stats.snapshot)
+        finally:
+            miner.verbose = verbose
 
     def graphs():
         opt = input("""
@@ -318,6 +373,7 @@ ZirCoin Graphs
         '3': {"handler": display_peer_info, "name": "Peer info"},
         '4': {"handler": hashrate, "name": "Test hashrate"},
         '5': {"handler": graphs, "name": "Graphs"},
+        '6': {"handler": mining_stats_view, "name": "Mining stats"},
     }
 
     banner = open("data/banner.txt", "r").read()
@@ -348,6 +404,12 @@ def main():
         server_thread.daemon = True
         server_thread.start()
 
+    if args.work_server:
+        work_server_thread = Thread(target=work_server.start_server, args=(
+            work_server.aiohttp_server(),), name="workserver")
+        work_server_thread.daemon = True
+        work_server_thread.start()
+
     connection_pool.add_seed_nodes()
 
     consensus_thread = Thread(target=consensus.consensus, name="consensus")